@@ -0,0 +1,175 @@
+/* Clientside callbacks of the models. The range slider of the collections
+and revenue of small datasets is filtered in the browser, from the summary
+per day and the buckets of each granularity shipped with the layout, so
+moving it or changing its granularity makes no request */
+(function () {
+  function round4(value) {
+    return value === null ? null : Math.round(value * 1e4) / 1e4;
+  }
+
+  function shortLabel(title) {
+    const chars = Array.from(title || '');
+    return chars.length > 10 ? chars.slice(0, 10).join('') + '...' : title;
+  }
+
+  /* Sums the statistics of each author between two day positions and returns
+  the k leaders, ties going to the first author as with pandas' nlargest */
+  function topAuthors(stats, first, last, by, k) {
+    const totals = new Map();
+    for (let i = stats.offsets[first]; i < stats.offsets[last]; i++) {
+      let total = totals.get(stats.author[i]);
+      if (!total) {
+        total = {code: stats.author[i], collections: 0, revenue: 0, entries: 0};
+        totals.set(stats.author[i], total);
+      }
+      total.collections += stats.collections[i] || 0;
+      total.revenue += stats.revenue[i] || 0;
+      total.entries += stats.entries[i] || 0;
+    }
+    const leaders = Array.from(totals.values());
+    leaders.sort((a, b) => (b[by] - a[by]) || (a.code - b.code));
+    return leaders.slice(0, k).map(total => ({
+      author: stats.names[total.code],
+      collections: total.collections,
+      revenue: round4(total.revenue),
+      entries: total.entries
+    }));
+  }
+
+  /* Merges the leaders of each day between two day positions and returns the
+  k with the best global rank */
+  function topEntries(leaders, first, last, k) {
+    const positions = [];
+    for (let i = leaders.offsets[first]; i < leaders.offsets[last]; i++) {
+      positions.push(i);
+    }
+    positions.sort((a, b) => leaders.rank[a] - leaders.rank[b]);
+    return positions.slice(0, k).map(i => ({
+      title: leaders.title[i],
+      link: leaders.link[i],
+      author: leaders.author[i],
+      collections: leaders.collections[i],
+      revenue: leaders.revenue[i]
+    }));
+  }
+
+  function column(rows, name) {
+    return rows.map(row => row[name]);
+  }
+
+  /* Returns a copy of a bar chart with new bars, keeping its layout */
+  function updateBars(figure, bars) {
+    const colors = bars.color.filter(value => value !== null);
+    const trace = figure.data[0];
+    const marker = Object.assign({}, trace.marker, {
+      color: bars.color,
+      cmin: colors.length ? Math.min(...colors) : null,
+      cmax: colors.length ? Math.max(...colors) : null
+    });
+    return Object.assign({}, figure, {
+      data: [Object.assign({}, trace, bars.trace, {marker: marker})]
+    });
+  }
+
+  function component(type, props) {
+    return {type: type, namespace: 'dash_html_components', props: props};
+  }
+
+  /* Same rows as gen_table */
+  function table(entries) {
+    const rows = entries.map((entry, i) => component('Tr', {
+      children: [
+        component('Td', {
+          children: (i + 1) + ': ',
+          style: {color: 'rgba(255, 172, 5, 1.00)'}
+        }),
+        component('Td', {
+          children: component('A', {
+            children: entry.title,
+            href: entry.link,
+            target: '_blank',
+            style: {color: 'white'}
+          })
+        })
+      ]
+    }));
+    return [component('Tbody', {children: rows, className: 'table-body'})];
+  }
+
+  window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    post3: {
+      /* Switches the range slider to the buckets of a granularity, selecting
+      all of them, and returns the days where each bucket begins */
+      selectBuckets: function (granularity, granularities) {
+        const buckets = granularities && granularities[granularity];
+        if (!buckets) {
+          throw window.dash_clientside.PreventUpdate;
+        }
+        const last = buckets.bounds.length - 2;
+        return [buckets.marks, last, [0, last], buckets.bounds];
+      },
+
+      filterCollectionsRevenue: function (
+          range, bounds, summary, collectionsAuthors, collectionsEntries,
+          revenueAuthors, revenueEntries) {
+        if (!range || !bounds || !summary) {
+          throw window.dash_clientside.PreventUpdate;
+        }
+        // the selected buckets are a contiguous range of days
+        const end = Math.min(range[range.length - 1], bounds.length - 2);
+        const start = Math.max(0, Math.min(range[0], end));
+        const first = bounds[start];
+        const last = bounds[end + 1];
+        const k = summary.k;
+
+        const authorsCollected = topAuthors(
+          summary.authors, first, last, 'collections', k);
+        const authorsRevenue = topAuthors(
+          summary.authors, first, last, 'revenue', k);
+        const collected = topEntries(summary.collections, first, last, k);
+        const revenue = topEntries(summary.revenue, first, last, k);
+
+        return [
+          updateBars(collectionsAuthors, {
+            trace: {
+              x: column(authorsCollected, 'collections'),
+              y: column(authorsCollected, 'author'),
+              meta: column(authorsCollected, 'revenue'),
+              customdata: column(authorsCollected, 'entries')
+            },
+            color: column(authorsCollected, 'revenue')
+          }),
+          updateBars(collectionsEntries, {
+            trace: {
+              x: column(collected, 'collections'),
+              y: collected.map(entry => shortLabel(entry.title)),
+              meta: column(collected, 'author'),
+              customdata: column(collected, 'title')
+            },
+            color: column(collected, 'revenue')
+          }),
+          updateBars(revenueAuthors, {
+            trace: {
+              x: column(authorsRevenue, 'revenue'),
+              y: column(authorsRevenue, 'author'),
+              meta: column(authorsRevenue, 'collections'),
+              customdata: column(authorsRevenue, 'entries')
+            },
+            color: column(authorsRevenue, 'collections')
+          }),
+          updateBars(revenueEntries, {
+            trace: {
+              x: column(revenue, 'revenue'),
+              y: revenue.map(entry => shortLabel(entry.title)),
+              meta: column(revenue, 'author'),
+              customdata: column(revenue, 'title')
+            },
+            color: column(revenue, 'collections')
+          }),
+          table(collected),
+          table(revenue)
+        ];
+      }
+    }
+  });
+})();
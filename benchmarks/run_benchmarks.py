@@ -0,0 +1,520 @@
+""" This script benchmarks the ingestion, the layouts of the models and the
+Dash callbacks on synthetic Post3 datasets. The results are written as JSON,
+with the time of every run and the peak memory of each case.
+
+Run it from the root of the repository, e.g.
+
+    python -m benchmarks.run_benchmarks --rows 1000 10000 --output out.json
+
+Each dataset size is benchmarked in its own processes, with an empty cache
+directory: once to time the cases and once to measure their peak memory,
+since tracing slows the code down. The peak memory adds the allocations of
+Python, traced by tracemalloc, to those of pyarrow's memory pool, which
+tracemalloc does not see. Both only cover this process, so the peak increase
+of the resident memory of this process and its children, which run the
+background callbacks, is also recorded. The first run of a case is
+the cold one (empty caches), the following runs are warm. Cases can be left
+out with a regular expression, e.g. --skip textual on the largest sizes """
+# pylint: disable=C0415
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from functools import partial
+
+SIZES = [1000, 10000, 100000, 1000000]
+REPEAT = 3
+
+# seconds between the requests polling a background callback
+POLL_INTERVAL = 0.05
+
+MODELS = ['Explorer', 'Collections & Revenue', 'Textual Analysis']
+
+# seconds between the samples of the memory while tracing a case
+SAMPLE_INTERVAL = 0.005
+
+
+class MemorySampler:
+    """ Samples the bytes allocated by pyarrow's memory pool and the resident
+    memory of this process and its children, such as the background jobs, in
+    a thread, and keeps their peak increase"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        import psutil
+        import pyarrow as pa
+
+        self.psutil = psutil
+        self.interval = interval
+        self.pool = pa.default_memory_pool()
+        self.process = psutil.Process()
+        self.arrow_start = self.arrow_peak = self.pool.bytes_allocated()
+        self.rss_start = self.rss_peak = self.rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def rss(self):
+        """ Returns the resident memory of the process and its children, in
+        bytes"""
+        rss = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except self.psutil.NoSuchProcess:  # exited meanwhile
+                continue
+        return rss
+
+    def sample(self):
+        """ Updates the peaks with the current memory"""
+        self.arrow_peak = max(self.arrow_peak, self.pool.bytes_allocated())
+        self.rss_peak = max(self.rss_peak, self.rss())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+    @property
+    def arrow_increase(self):
+        """ Peak bytes allocated by pyarrow above those held at the start"""
+        return self.arrow_peak - self.arrow_start
+
+    @property
+    def rss_increase(self):
+        """ Peak resident memory above the one at the start, in bytes"""
+        return self.rss_peak - self.rss_start
+
+
+class Recorder:
+    """ Runs the cases of a benchmark and records the seconds of each run, or
+    their peak memory when tracing: the Python and pyarrow allocations, and
+    the resident memory"""
+
+    def __init__(self, trace=False, skip=None):
+        self.trace = trace
+        self.skip = re.compile(skip) if skip else None
+        self.results = []
+
+    def skipped(self, case):
+        """ Checks if a case is left out of the benchmark"""
+        return bool(self.skip and self.skip.search(case))
+
+    def measure(self, case, func, repeat=1, required=False):
+        """ Runs func repeat times and returns the result of the last run.
+        Skipped cases are not run, unless the next cases need their result,
+        in which case they are run once without being recorded."""
+        if self.skipped(case):
+            return func() if required else None
+
+        seconds = []
+        peak = rss_peak = 0
+        result = None
+        for _ in range(repeat):
+            if not self.trace:
+                start = time.perf_counter()
+                result = func()
+                seconds.append(time.perf_counter() - start)
+                continue
+
+            tracemalloc.start()
+            with MemorySampler() as sampler:
+                start = time.perf_counter()
+                result = func()
+                seconds.append(time.perf_counter() - start)
+            peak = max(
+                peak,
+                tracemalloc.get_traced_memory()[1] + sampler.arrow_increase)
+            rss_peak = max(rss_peak, sampler.rss_increase)
+            tracemalloc.stop()
+
+        if self.trace:
+            self.results.append({
+                'case': case,
+                'peak_mb': peak / 1024 ** 2,
+                'peak_rss_mb': rss_peak / 1024 ** 2})
+        else:
+            self.results.append({'case': case, 'seconds': seconds})
+        print(f"  {case}: {', '.join(f'{s:.3f}s' for s in seconds)}",
+              file=sys.stderr)
+        return result
+
+
+class CallbackClient:
+    """ Calls the Dash callbacks of the app through the Flask test client, as
+    the browser does"""
+
+    def __init__(self, path='/models/'):
+        from flask import Flask
+        from dash_models import dash_app_models
+
+        server = Flask(__name__)
+        dash_app_models(server, path=path)
+        self.path = path
+        self.client = server.test_client()
+        self.dependencies = self.client.get(
+            f"{path}_dash-dependencies").get_json()
+
+    def call(self, output, inputs, state=(), changed=()):
+        """ Calls the callback of an output with the values of its inputs and
+        state. Returns the response, or None if the update was prevented."""
+        dependency = next(
+            d for d in self.dependencies if output in d['output'])
+        outputs = [
+            dict(zip(('id', 'property'), spec.rsplit('.', 1)))
+            for spec in dependency['output'].strip('.').split('...')]
+        body = {
+            'output': dependency['output'],
+            'outputs': (
+                outputs if dependency['output'].startswith('..')
+                else outputs[0]),
+            'inputs': [
+                dict(spec, value=value)
+                for spec, value in zip(dependency['inputs'], inputs)],
+            'state': [
+                dict(spec, value=value)
+                for spec, value in zip(dependency['state'], state)],
+            'changedPropIds': list(changed)}
+        url = f"{self.path}_dash-update-component"
+        response = self.client.post(url, json=body)
+        # background callbacks return their job, which is polled as the
+        # browser does until its result is ready
+        job = response.get_json() if response.status_code == 200 else {}
+        while 'cacheKey' in job and 'response' not in job:
+            time.sleep(POLL_INTERVAL)
+            response = self.client.post(
+                url, json=body, query_string={
+                    key: job[key] for key in ['cacheKey', 'job']
+                    if job.get(key) is not None})
+            if response.status_code != 200:
+                break
+            job = dict(job, **response.get_json())
+
+        if response.status_code == 204:
+            return None
+        if response.status_code != 200:
+            raise RuntimeError(
+                f"{output} callback failed with {response.status_code}")
+        return response.get_json()['response']
+
+    def get(self, url):
+        """ Fetches a url of the app, returning the body"""
+        response = self.client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} failed with {response.status_code}")
+        return response.data
+
+
+def bench_ingestion(recorder, df, repeat):
+    """ Benchmarks the parsing of the uploads into the columnar cache, as
+    the app does: the decoded upload is spooled to disk, then ingested"""
+    from benchmarks.synthetic import to_upload, DATE_FORMATS
+    from data_handler.ingestion import content_hash, spool_upload
+    from data_handler.ingestion import ingest_spooled, read_dataset
+
+    def ingest(content_string, dataset_id, filename):
+        spool_upload(content_string, dataset_id)
+        ingest_spooled(dataset_id, filename)
+        return dataset_id
+
+    for name, filename in [('json', 'data.json'), ('jsonl', 'data.jsonl')]:
+        for dates in DATE_FORMATS:
+            contents = to_upload(df, name == 'jsonl', dates)
+            content_string = contents.split(',')[1]
+            case = name if dates == 'iso' else f"{name}/{dates}"
+            if dates == 'iso':
+                recorder.measure(
+                    f"ingestion/content_hash/{name}",
+                    partial(content_hash, content_string), repeat)
+            # a new id every run, so the columnar cache is never hit
+            ids = iter(range(repeat))
+            dataset_id = recorder.measure(
+                f"ingestion/ingest_spooled/{case}",
+                lambda: ingest(
+                    content_string, f"bench{name}{dates}{next(ids)}",
+                    filename),
+                repeat)
+            if dataset_id is not None:
+                check_dates(read_dataset(dataset_id), df, case)
+
+
+def check_dates(ingested, df, case):
+    """ Checks that the dates of an upload were ingested as generated, the
+    dates with a timezone being compared in UTC"""
+    if ingested is None:
+        return
+    dates = ingested['date']
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_convert(None)
+    if not (dates.to_numpy() == df['date'].to_numpy()).all():
+        raise AssertionError(f"{case}: the dates were not ingested as sent")
+
+
+def bench_layouts(recorder, df, repeat):
+    """ Benchmarks the layouts of the models, called directly with their
+    own store. The first run computes the derived values, which are then
+    loaded from the artifacts by the store of another worker."""
+    from data_handler.artifact_store import ArtifactStore
+    from data_handler.dataset_store import DatasetStore
+    from dash_models import MODELS as LAYOUTS
+    from models.textual_analysis import LANGUAGE_MEMO
+
+    for model in MODELS:
+        store = DatasetStore()
+        store.put(df, 'bench')
+        LANGUAGE_MEMO.clear()
+        recorder.measure(
+            f"layout/{slug(model)}",
+            partial(LAYOUTS[model], df, partial(store.derive, 'bench')),
+            repeat)
+
+    artifacts = ArtifactStore()
+    for model in MODELS:
+        stores = [DatasetStore(artifacts=artifacts) for _ in range(2)]
+        for store in stores:
+            store.put(df, 'bench')
+        LAYOUTS[model](df, partial(stores[0].derive, 'bench'))
+        LANGUAGE_MEMO.clear()
+        recorder.measure(
+            f"layout/{slug(model)}/from_artifacts",
+            partial(LAYOUTS[model], df, partial(stores[1].derive, 'bench')))
+
+
+def bench_callbacks(recorder, df, repeat):
+    """ Benchmarks the callbacks of the app: the upload, the layouts and the
+    updates of each model"""
+    from benchmarks.synthetic import to_upload
+    from models.textual_analysis import LANGUAGE_MEMO
+    from dash_models import WORDCLOUD_MODEL
+
+    app = CallbackClient()
+    contents = to_upload(df)
+    upload = recorder.measure(
+        'callback/store_upload',
+        lambda: app.call('upload-id', ['data.json', contents])[
+            'upload-id']['data'],
+        repeat, required=True)
+    dataset_id = recorder.measure(
+        'callback/upload_file',
+        lambda: app.call('dataset-id', [upload])['dataset-id']['data'],
+        repeat, required=True)
+
+    LANGUAGE_MEMO.clear()
+    layouts = {
+        model: recorder.measure(
+            f"callback/render_model/{slug(model)}",
+            partial(app.call, 'dynamic-layout', [model, dataset_id]), repeat)
+        for model in MODELS}
+
+    # range slider of the collections and revenue
+    slider = 'callback/update_collections_authors_figure'
+    for granularity in ['week', 'day']:
+        recorder.measure(
+            f"{slider}/granularity/{granularity}",
+            partial(
+                app.call, 'graph-collections-authors',
+                [[0, 0], granularity], [dataset_id],
+                ['granularity-col-rev.value']))
+        recorder.measure(
+            f"{slider}/range/{granularity}",
+            partial(
+                app.call, 'graph-collections-authors',
+                [[1, 2], granularity], [dataset_id],
+                ['slider-collections-authors.value']),
+            repeat)
+
+    # filters and pages of the explorer
+    explorer = 'callback/update_articles_explorer'
+    filters = {
+        'page': ([None, 'any', None, 2], 'pagination-explorer.active_page'),
+        'tags_any': ([['web3', 'nft'], 'any', None, 1],
+                     'tags-dropdown-explorer.value'),
+        'tags_all': ([['web3', 'nft'], 'all', None, 1],
+                     'tags-mode-explorer.value'),
+        'search': ([None, 'any', 'ethereum gov', 1],
+                   'search-explorer.value'),
+        'search_tags': ([['web3'], 'any', 'ethereum gov', 1],
+                        'search-explorer.value')}
+    for name, (inputs, changed) in filters.items():
+        recorder.measure(
+            f"{explorer}/{name}",
+            partial(
+                app.call, 'table-tags', inputs, [dataset_id], [changed]),
+            repeat)
+
+    # word clouds, rendered by the job of the textual layout and served as
+    # images
+    if layouts[WORDCLOUD_MODEL] is None:
+        return
+    urls = recorder.measure(
+        'callback/load_wordclouds',
+        partial(
+            app.call, 'wordcloud-titles', ['wordcloud-titles'],
+            [dataset_id]),
+        required=True)
+    for name in ['titles', 'descriptions']:
+        url = urls[f"wordcloud-{name}"]['src']
+        recorder.measure(
+            f"route/wordcloud/{name}", partial(app.get, url), repeat)
+
+
+def slug(name):
+    """ Returns the name of a model in lower case, without spaces"""
+    return re.sub(r'\W+', '_', name.lower()).strip('_')
+
+
+def run_worker(args):
+    """ Benchmarks one dataset size in this process and writes the records
+    to the output file"""
+    from benchmarks.synthetic import gen_dataset
+
+    recorder = Recorder(trace=args.trace, skip=args.skip)
+    pass_name = 'memory' if args.trace else 'time'
+    print(f"{args.rows[0]} rows ({pass_name})", file=sys.stderr)
+    df = gen_dataset(args.rows[0], seed=args.seed)
+
+    bench_ingestion(recorder, df, args.repeat)
+    bench_callbacks(recorder, df, args.repeat)
+    bench_layouts(recorder, df, args.repeat)
+
+    with open(args.worker_output, 'w', encoding='utf-8') as file:
+        json.dump({
+            'results': recorder.results,
+            'max_rss_mb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss / 1024}, file)
+
+
+def run_size(args, n_rows, trace):
+    """ Runs the benchmarks of a dataset size in a new process, with an
+    empty cache directory. Returns the records of the worker."""
+    cache_dir = tempfile.mkdtemp(prefix='post3_bench_')
+    output = os.path.join(cache_dir, 'results.json')
+    command = [
+        sys.executable, '-m', 'benchmarks.run_benchmarks', '--worker',
+        '--rows', str(n_rows), '--repeat', str(args.repeat),
+        '--seed', str(args.seed), '--worker-output', output]
+    if trace:
+        command.append('--trace')
+    if args.skip:
+        command += ['--skip', args.skip]
+    try:
+        subprocess.run(
+            command, check=True,
+            env=dict(os.environ, POST3_CACHE_DIR=cache_dir),
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        with open(output, encoding='utf-8') as file:
+            return json.load(file)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def summarise(n_rows, timed, traced):
+    """ Merges the times and the peak memory of the cases of a size"""
+    peaks = {
+        record['case']: record
+        for record in (traced or {}).get('results', [])}
+    return [
+        {
+            'case': record['case'],
+            'rows': n_rows,
+            'runs': record['seconds'],
+            'first_s': record['seconds'][0],
+            'min_s': min(record['seconds']),
+            'median_s': statistics.median(record['seconds']),
+            'peak_mb': peaks.get(record['case'], {}).get('peak_mb'),
+            'peak_rss_mb': peaks.get(record['case'], {}).get('peak_rss_mb')}
+        for record in timed['results']]
+
+
+def environment():
+    """ Returns the versions of the platform and the libraries"""
+    import dash
+    import numpy as np
+    import pandas as pd
+    import plotly
+    import pyarrow as pa
+
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'dash': dash.__version__,
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'plotly': plotly.__version__,
+        'pyarrow': pa.__version__}
+
+
+def parse_args():
+    """ Returns the arguments of the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--rows', type=int, nargs='+', default=SIZES,
+        help='dataset sizes to benchmark')
+    parser.add_argument(
+        '--repeat', type=int, default=REPEAT,
+        help='runs of each case, the first one being cold')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--skip', help='regular expression of the cases to leave out')
+    parser.add_argument(
+        '--no-memory', action='store_true',
+        help='only time the cases, without measuring the peak memory')
+    parser.add_argument(
+        '--output', help='path of the JSON results (default: stdout)')
+    parser.add_argument(
+        '--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--trace', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--worker-output', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    """ Benchmarks every dataset size and writes the results"""
+    args = parse_args()
+    if args.worker:
+        run_worker(args)
+        return
+
+    report = {'environment': environment(), 'sizes': [], 'results': []}
+    for n_rows in args.rows:
+        timed = run_size(args, n_rows, trace=False)
+        traced = None if args.no_memory else run_size(args, n_rows, True)
+        report['sizes'].append({
+            'rows': n_rows,
+            'max_rss_mb': timed['max_rss_mb']})
+        report['results'] += summarise(n_rows, timed, traced)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
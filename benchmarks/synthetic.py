@@ -0,0 +1,123 @@
+""" This script generates synthetic Post3 datasets for the benchmarks. The
+columns follow the schema of the weekly datasets: the texts mix languages,
+html and links, the authors are skewed and the dates span several weeks """
+import base64
+import numpy as np
+import pandas as pd
+
+WORDS = {
+    'en': (
+        'web3 nft crypto ethereum dao defi writing mirror paragraph arweave '
+        'token community governance layer rollup market protocol wallet '
+        'collectors creators onchain publishing essay future open network '
+        'value ownership identity social graph builders week report data '
+        'the of and to in is for on with that this we are it you'),
+    'es': (
+        'el la de que y en los se del las un por con una para es al lo como '
+        'comunidad escritura cadena bloques futuro datos valor red'),
+    'fr': (
+        'le la de et les des en un une du est que pour dans sur pas plus '
+        'avec communauté écriture chaîne blocs avenir données valeur réseau'),
+}
+
+# share of the descriptions in each language, then missing ones
+LANGUAGES = ['en', 'es', 'fr']
+LANGUAGE_SHARES = [0.7, 0.1, 0.1]
+MISSING_SHARE = 0.1
+
+NETWORKS = ['optimism', 'ethereum', 'polygon', 'base', 'zora', 'arbitrum']
+NETWORK_SHARES = [0.5, 0.2, 0.1, 0.1, 0.05, 0.05]
+
+TAGS = WORDS['en'].split()[:40]
+
+# encodings of the dates in the uploads: naive ISO strings, ISO strings in
+# UTC ending in Z, and epoch milliseconds (the default of pandas' to_json)
+DATE_FORMATS = ['iso', 'utc', 'epoch']
+START_DATE = '2023-12-04'
+
+
+def gen_texts(rng, n, low, high, language='en'):
+    """ Returns n texts of random words, with between low and high words"""
+    vocabulary = np.array(WORDS[language].split())
+    lengths = rng.integers(low, high, n)
+    words = vocabulary[rng.integers(0, len(vocabulary), lengths.sum())]
+    words = words.tolist()
+    ends = np.cumsum(lengths).tolist()
+    return [
+        ' '.join(words[start:end])
+        for start, end in zip([0] + ends[:-1], ends)]
+
+
+def gen_bodies(rng, n):
+    """ Returns n article bodies, some of them with html tags and links"""
+    bodies = np.array(gen_texts(rng, n, 20, 120), dtype=object)
+    html = rng.random(n) < 0.3
+    bodies[html] = '<p>' + bodies[html] + '</p>'
+    links = rng.random(n) < 0.2
+    bodies[links] = bodies[links] + ' https://mirror.xyz/post3.eth'
+    return bodies
+
+
+def gen_descriptions(rng, n):
+    """ Returns n descriptions in several languages, some of them missing"""
+    descriptions = np.empty(n, dtype=object)
+    choice = rng.choice(
+        len(LANGUAGES) + 1, n, p=LANGUAGE_SHARES + [MISSING_SHARE])
+    for i, language in enumerate(LANGUAGES):
+        mask = choice == i
+        descriptions[mask] = gen_texts(rng, mask.sum(), 5, 30, language)
+    return descriptions
+
+
+def gen_tags(rng, n):
+    """ Returns n lists of up to 5 tags, the first tags being the most
+    common"""
+    tags = np.array(TAGS)
+    weights = 1 / np.arange(1, len(tags) + 1)
+    weights /= weights.sum()
+    lengths = rng.integers(0, 6, n)
+    picks = rng.choice(len(tags), lengths.sum(), p=weights).tolist()
+    ends = np.cumsum(lengths).tolist()
+    return [
+        sorted(set(tags[picks[start:end]]))
+        for start, end in zip([0] + ends[:-1], ends)]
+
+
+def gen_dataset(n_rows, seed=0, weeks=4):
+    """ Generates a dataset with n_rows articles published during the given
+    number of weeks"""
+    rng = np.random.default_rng(seed)
+    n_authors = max(1, n_rows // 5)
+
+    # a few authors publish most of the articles
+    authors = np.minimum(
+        rng.zipf(1.5, n_rows) - 1, n_authors - 1).astype(int)
+    collections = rng.zipf(1.8, n_rows).clip(max=100000) - 1
+    revenue = np.round(collections * rng.uniform(0, 0.01, n_rows), 6)
+    seconds = rng.integers(0, weeks * 7 * 24 * 3600, n_rows)
+
+    return pd.DataFrame({
+        'title': gen_texts(rng, n_rows, 2, 12),
+        'body': gen_bodies(rng, n_rows),
+        'description': gen_descriptions(rng, n_rows),
+        'author': [f"author{i}.eth" for i in authors],
+        'author_link': [f"https://mirror.xyz/author{i}.eth" for i in authors],
+        'link': [f"https://mirror.xyz/post/{i}" for i in range(n_rows)],
+        'tags': gen_tags(rng, n_rows),
+        'date': pd.Timestamp(START_DATE) + pd.to_timedelta(seconds, 's'),
+        'collections': collections,
+        'revenue': revenue,
+        'network': rng.choice(NETWORKS, n_rows, p=NETWORK_SHARES),
+        'price_usd': np.round(rng.uniform(0, 5, n_rows), 2),
+    })
+
+
+def to_upload(df, json_lines=False, dates='iso'):
+    """ Encodes a dataset as the contents sent by the upload component, with
+    the dates in one of the DATE_FORMATS"""
+    if dates == 'utc':
+        df = df.assign(date=df['date'].dt.tz_localize('UTC'))
+    raw = df.to_json(
+        orient='records', date_format='epoch' if dates == 'epoch' else 'iso',
+        lines=json_lines).encode()
+    return 'data:application/json;base64,' + base64.b64encode(raw).decode()
@@ -1,30 +1,126 @@
 """ This script instantiates the route containin the models and dashboards """
 # pylint: disable=W0612
-# pylint: disable=W0603
-# pylint: disable=W0602
-import base64
-import io
 from datetime import datetime
-import pandas as pd
+from functools import partial
 import dash_bootstrap_components as dbc
-from dash import Dash, html, dcc
-from dash.dependencies import Input, Output
+from flask import abort, send_file
+from dash import Dash, html, dcc, ctx, no_update, ClientsideFunction
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 from models.collections_n_revenue import gen_layout_col_rev
-from models.collections_n_revenue import gen_df_sort_collections
-from models.collections_n_revenue import gen_df_sort_revenue
-from models.collections_n_revenue import create_collections_authors_figure
-from models.collections_n_revenue import create_collections_entries_figure
-from models.collections_n_revenue import create_revenue_authors_figure
-from models.collections_n_revenue import create_revenue_entries_figure
+from models.collections_n_revenue import gen_sorted_views, select_top_k
+from models.collections_n_revenue import gen_author_stats
+from models.collections_n_revenue import select_authors_top_k
+from models.collections_n_revenue import author_bars, entry_bars, patch_bars
 from models.collections_n_revenue import gen_table
+from models.date_index import gen_date_index, gen_buckets, gen_marks
+from models.date_index import day_range
 from models.textual_analysis import gen_layout_textual
+from models.textual_analysis import gen_wordcloud_frequencies, render_wordcloud
 from models.explorer import gen_layout_explorer, gen_table_explorer
+from models.explorer import gen_explorer_rows, gen_collections_order
+from models.explorer import n_pages, page_rows, memo_rows, PAGE_SIZE
+from models.tag_index import gen_tag_index
+from data_handler.dataset_store import DatasetStore
+from data_handler.artifact_store import ArtifactStore
+from data_handler.ingestion import content_hash, spool_upload
+from data_handler.ingestion import ingest_spooled
+from data_handler.ingestion import read_dataset, dataset_columns
+from data_handler.figure_cache import FigureCache, figure_key
+from data_handler.wordcloud_cache import cache_wordcloud, cached_wordcloud
+from data_handler.search_index import build_search_index, has_search_index
+from data_handler.search_index import search, count_matches
+from data_handler.background import gen_background_manager
 
 # VARIABLES
-df = pd.DataFrame()
+# uploaded datasets, fetched by the sessions' ids, and what is derived from
+# them, persisted for the other workers
+datasets = DatasetStore(artifacts=ArtifactStore())
+figures = FigureCache()  # serialised figures, shared by the workers
+# jobs of the slow callbacks, forked with this module already imported
+background_manager = gen_background_manager(preload=[__name__])
 year = datetime.today().year
 footer = f"Running in {year}. Built with ❤️ for Web3 enthusiasts."
 
+# outputs of the range slider callback, cached by dataset and range
+COL_REV_CHARTS = [
+    'graph-collections-authors',
+    'graph-collections-entries',
+    'graph-revenue-authors',
+    'graph-revenue-entries',
+    'table-collections',
+    'table-revenue'
+]
+
+# columns read by the callbacks that do not build a layout
+SLIDER_COLUMNS = ['date', 'title', 'link', 'author', 'collections', 'revenue']
+EXPLORER_COLUMNS = [
+    'title', 'link', 'author', 'author_link', 'tags', 'collections']
+SEARCH_COLUMNS = ['title', 'description', 'body']
+
+# word clouds of the textual analysis, rendered by the job building its
+# layout and served as images
+WORDCLOUDS = ['titles', 'descriptions']
+WORDCLOUD_MODEL = 'Textual Analysis'
+
+# registry of the available models, the layouts are only built when selected
+MODELS = {
+    'Explorer': gen_layout_explorer,
+    "Collections & Revenue": gen_layout_col_rev,
+    'Textual Analysis': gen_layout_textual
+}
+
+
+def fetch_dataset(dataset_id, columns=None):
+    """ Returns the dataset with the given id, with at least the requested
+    columns (all of them by default). The columns missing from the store of
+    this worker are loaded from the columnar cache, so callbacks that only
+    read a few columns never convert the bodies of the articles."""
+    if dataset_id is None:
+        return None
+    df = datasets.get(dataset_id)
+    if df is not None and columns is not None and set(columns).issubset(
+            df.columns):
+        return df
+
+    names = dataset_columns(dataset_id)
+    if names is None:
+        return df
+    wanted = [name for name in names if columns is None or name in columns]
+    if df is None:
+        df = read_dataset(dataset_id, wanted)
+        if df is not None:
+            datasets.put(df, dataset_id)
+        return df
+
+    missing = [name for name in wanted if name not in df.columns]
+    if missing:
+        extended = datasets.add_columns(
+            dataset_id, read_dataset(dataset_id, missing))
+        df = df if extended is None else extended
+    return df
+
+
+def filter_explorer_rows(dataset_id, df, tags, mode, search_text):
+    """ Returns the positions of the entries of a dataset having the tags,
+    ranked by the search if there is one, otherwise by collections"""
+    tag_index = datasets.derive(
+        dataset_id, 'tag_index', gen_tag_index, df)
+    search_rows = search(dataset_id, search_text) if search_text else None
+    return gen_explorer_rows(df, tag_index, tags, mode, search_rows)
+
+
+def render_dataset_wordcloud(dataset_id, df, name):
+    """ Renders a word cloud of a dataset as PNG bytes, or returns None if
+    its texts have no words. The word frequencies are cached in the
+    store."""
+    frequencies = gen_wordcloud_frequencies(
+        name, partial(datasets.derive, dataset_id, df=df))
+    if not frequencies:
+        return None
+    return render_wordcloud(frequencies)
+
+
 external_stylesheets = [
     "https://fonts.googleapis.com"
     "/css2?family=Bayon&family=Gruppo&family=Poppins:wght@300&display=swap",
@@ -42,9 +138,21 @@ def dash_app_models(flask_app, path):
         __name__,
         server=flask_app,  # rendered by the flask app
         url_base_pathname=path,  # the flask route for this page
-        external_stylesheets=external_stylesheets  # bootstrap components
+        external_stylesheets=external_stylesheets,  # bootstrap components
+        background_callback_manager=background_manager
     )
 
+    @flask_app.route(f"{path}wordclouds/<dataset_id>/<name>.png")
+    def serve_wordcloud(dataset_id, name):
+        """ Serves the image of a word cloud, rendered by the job building
+        the textual layout"""
+        if name not in WORDCLOUDS or not dataset_id.isalnum():
+            abort(404)
+        image = cached_wordcloud(dataset_id, name)
+        if image is None:
+            abort(404)
+        return send_file(image, mimetype='image/png', max_age=86400)
+
     app._favicon = "assets/favicon.ico"
     app.title = 'Post3 Engine'
 
@@ -78,14 +186,14 @@ def dash_app_models(flask_app, path):
                         ),
                         dcc.Dropdown(
                             id='models-dropdown',
-                            options=[
-                                'Explorer',
-                                "Collections & Revenue",
-                                'Textual Analysis'
-                                ],
+                            options=list(MODELS),
                             className="dropdown-models"
                         ),
                     ], className="upload-container"),
+                    html.P(id='progress-upload', className='progress-models'),
+                    html.P(id='progress-model', className='progress-models'),
+                    dcc.Store(id='upload-id'),
+                    dcc.Store(id='dataset-id'),
                     dcc.Loading([
                         html.Div(id='dynamic-layout')],
                         id="loading-output",
@@ -100,33 +208,96 @@ def dash_app_models(flask_app, path):
                 ], className='fade-in')
 
     @app.callback(
-        Output('dynamic-layout', 'children'),
+        Output('upload-id', 'data'),
         [
-            Input(
-                component_id='models-dropdown',
-                component_property='value'),
             Input(
                 component_id='upload-dataset',
                 component_property='filename'),
             Input(
                 component_id='upload-dataset',
                 component_property='contents')])
-    def upload_file(selected_model, uploaded_filename, uploaded_content):
-        """ This function renders a layout for the selected model. It takes the
-        model and the dataset as inputs."""
-        if uploaded_filename is not None and uploaded_content is not None:
-            content_type, content_string = uploaded_content.split(',')
-            decoded = base64.b64decode(content_string)
-            if 'json' in uploaded_filename:
-                global df
-                df = pd.read_json(io.StringIO(decoded.decode('utf-8')))
-                models = {
-                    'Explorer': gen_layout_explorer(df),
-                    "Collections & Revenue": gen_layout_col_rev(df),
-                    "Textual Analysis": gen_layout_textual(df)
-                }
-
-                return models[selected_model]
+    def store_upload(uploaded_filename, uploaded_content):
+        """ This function writes the uploaded file to disk under the hash of
+        its content, unless it was already ingested. Only the hash is passed
+        to the background job ingesting it, so the browser does not send the
+        file again while polling the job."""
+        if uploaded_filename is None or uploaded_content is None:
+            raise PreventUpdate
+        if 'json' not in uploaded_filename:
+            raise PreventUpdate
+        content_type, content_string = uploaded_content.split(',')
+        dataset_id = content_hash(content_string)
+        if dataset_columns(dataset_id) is None:
+            spool_upload(content_string, dataset_id)
+
+        return {'id': dataset_id, 'filename': uploaded_filename}
+
+    @app.callback(
+        Output('dataset-id', 'data'),
+        Input('upload-id', 'data'),
+        background=True,
+        progress=Output('progress-upload', 'children'),
+        running=[
+            (Output('models-dropdown', 'disabled'), True, False),
+            (Output('progress-upload', 'hidden'), False, True)])
+    def upload_file(set_progress, upload):
+        """ This function parses the uploaded dataset into the columnar
+        cache, in a background job. It returns the content hash used to
+        fetch it, so a dataset that was already uploaded is not parsed
+        again."""
+        if upload is None:
+            raise PreventUpdate
+        dataset_id = upload['id']
+        set_progress('Reading the dataset')
+        if not ingest_spooled(
+                dataset_id, upload['filename'],
+                lambda n_rows: set_progress(f"{n_rows} articles read")):
+            raise PreventUpdate
+        if not has_search_index(dataset_id):
+            set_progress('Indexing the articles')
+            build_search_index(
+                fetch_dataset(dataset_id, SEARCH_COLUMNS), dataset_id)
+
+        return dataset_id
+
+    @app.callback(
+        Output('dynamic-layout', 'children'),
+        [
+            Input(
+                component_id='models-dropdown',
+                component_property='value'),
+            Input(
+                component_id='dataset-id',
+                component_property='data')],
+        background=True,
+        progress=Output('progress-model', 'children'),
+        running=[(Output('progress-model', 'hidden'), False, True)],
+        cancel=[Input('upload-id', 'data')])
+    def render_model(set_progress, selected_model, dataset_id):
+        """ This function renders a layout for the selected model, using the
+        dataset uploaded by the session. It runs in a background job, which
+        is cancelled when another model or dataset is selected."""
+        if selected_model not in MODELS or dataset_id is None:
+            raise PreventUpdate
+        set_progress('Loading the dataset')
+        df = fetch_dataset(dataset_id)
+        if df is None:
+            return html.P(
+                'The dataset has expired, please submit it again',
+                className='tags-search-title')
+
+        # the stored dataset is shared by the sessions: the layouts read it
+        # without modifying it and cache what they compute in the store
+        set_progress(f"Building the {selected_model} dashboard")
+        layout = MODELS[selected_model](
+            df, partial(datasets.derive, dataset_id, df=df))
+        if selected_model == WORDCLOUD_MODEL:
+            set_progress('Drawing the word clouds')
+            for name in WORDCLOUDS:
+                cache_wordcloud(
+                    dataset_id, name,
+                    partial(render_dataset_wordcloud, dataset_id, df, name))
+        return layout
 
     @app.callback(
         [
@@ -136,48 +307,196 @@ def dash_app_models(flask_app, path):
             Output('graph-revenue-entries', 'figure'),
             Output('table-collections', 'children'),
             Output('table-revenue', 'children'),
+            Output('slider-collections-authors', 'marks'),
+            Output('slider-collections-authors', 'max'),
+            Output('slider-collections-authors', 'value'),
+        ],
+        [
+            Input('slider-collections-authors', 'value'),
+            Input('granularity-col-rev', 'value'),
         ],
-        Input('slider-collections-authors', 'value')
+        State('dataset-id', 'data')
     )
-    def update_collections_authors_figure(selected_date_range):
+    def update_collections_authors_figure(selected_date_range, granularity,
+                                          dataset_id):
         """ This function updates the charts and tables, by using a
-        Range Slider as input. """
-        global df
-        df_collected = gen_df_sort_collections(df)
-        df_revenue = gen_df_sort_revenue(df)
+        Range Slider as input. Changing the granularity of the slider
+        resets it to the whole dataset."""
+        if dataset_id is None:
+            raise PreventUpdate
+        slider = [no_update] * 3
+        buckets = None
+        if ctx.triggered_id == 'granularity-col-rev':
+            dates = fetch_dataset(dataset_id, ['date'])
+            if dates is None:
+                raise PreventUpdate
+            buckets = gen_buckets(
+                datasets.derive(
+                    dataset_id, 'date_index', gen_date_index, dates),
+                granularity)
+            n_buckets = len(buckets['starts'])
+            selected_date_range = [0, n_buckets - 1]
+            slider = [gen_marks(buckets), n_buckets - 1, selected_date_range]
         start = selected_date_range[0]
         end = selected_date_range[-1]
-        dates = sorted(df['date'].unique())
-        dates = dates[start:end]
-        filt_df_collected = df_collected[
-            df_collected['date'].isin(dates)]
-        filt_df_revenue = df_revenue[
-            df_revenue['date'].isin(dates)]
 
-        return [
-            create_collections_authors_figure(filt_df_collected),
-            create_collections_entries_figure(filt_df_collected),
-            create_revenue_authors_figure(filt_df_revenue),
-            create_revenue_entries_figure(filt_df_revenue),
+        # ranges that were already selected skip pandas and plotly
+        keys = [
+            figure_key(dataset_id, chart, granularity, start, end)
+            for chart in COL_REV_CHARTS]
+        cached = figures.get_many(keys)
+        if None not in cached:
+            return cached + slider
+
+        df = fetch_dataset(dataset_id, SLIDER_COLUMNS)
+        if df is None:
+            raise PreventUpdate
+        # the slider selects whole days, weeks or months, which are
+        # contiguous ranges of the days of the index
+        if buckets is None:
+            buckets = gen_buckets(
+                datasets.derive(
+                    dataset_id, 'date_index', gen_date_index, df),
+                granularity)
+        start, end = day_range(buckets, start, end)
+
+        # the rankings and the leaders of each day are computed once
+        views = datasets.derive(
+            dataset_id, 'sorted_views', gen_sorted_views, df)
+        filt_df_collected = select_top_k(df, views, 'collections', start, end)
+        filt_df_revenue = select_top_k(df, views, 'revenue', start, end)
+        author_stats = datasets.derive(
+            dataset_id, 'author_stats', gen_author_stats, df)
+
+        # the layouts of the charts do not change with the range, so only
+        # their bars are sent
+        outputs = [
+            patch_bars(author_bars(select_authors_top_k(
+                author_stats, 'collections', start, end), 'collections')),
+            patch_bars(entry_bars(filt_df_collected, 'collections')),
+            patch_bars(author_bars(select_authors_top_k(
+                author_stats, 'revenue', start, end), 'revenue')),
+            patch_bars(entry_bars(filt_df_revenue, 'revenue')),
             gen_table(filt_df_collected),
             gen_table(filt_df_revenue),
             ]
+        figures.set_many(dict(zip(keys, outputs)))
+
+        return outputs + slider
+
+    @app.callback(
+        [
+            Output('wordcloud-titles', 'src'),
+            Output('wordcloud-descriptions', 'src'),
+        ],
+        Input('wordcloud-titles', 'id'),
+        State('dataset-id', 'data')
+    )
+    def load_wordclouds(_, dataset_id):
+        """ This function points the images of the word clouds to the route
+        serving them once the textual layout is displayed, the id of the
+        image only firing the callback then. The job building the layout
+        rendered them."""
+        if dataset_id is None:
+            raise PreventUpdate
+        return [
+            f"{path}wordclouds/{dataset_id}/{name}.png"
+            for name in WORDCLOUDS]
+
+    # the granularity of small datasets is switched in the browser, from the
+    # buckets of each granularity shipped with the layout
+    app.clientside_callback(
+        ClientsideFunction(namespace='post3', function_name='selectBuckets'),
+        [
+            Output('slider-collections-authors-client', 'marks'),
+            Output('slider-collections-authors-client', 'max'),
+            Output('slider-collections-authors-client', 'value'),
+            Output('buckets-col-rev', 'data'),
+        ],
+        Input('granularity-col-rev-client', 'value'),
+        State('granularities-col-rev', 'data'),
+        prevent_initial_call=True
+    )
+
+    # the charts of small datasets are filtered in the browser
+    app.clientside_callback(
+        ClientsideFunction(
+            namespace='post3', function_name='filterCollectionsRevenue'),
+        [
+            Output(chart, 'children' if chart.startswith('table') else
+                   'figure', allow_duplicate=True)
+            for chart in COL_REV_CHARTS],
+        [
+            Input('slider-collections-authors-client', 'value'),
+            Input('buckets-col-rev', 'data'),
+        ],
+        [State('summary-col-rev', 'data')] + [
+            State(chart, 'figure')
+            for chart in COL_REV_CHARTS if chart.startswith('graph')],
+        prevent_initial_call=True
+    )
 
     @app.callback(
         [
             Output('table-tags', 'children'),
+            Output('results-explorer', 'children'),
+            Output('pagination-explorer', 'max_value'),
+            Output('pagination-explorer', 'active_page'),
         ],
-        Input('tags-dropdown-explorer', 'value')
+        [
+            Input('tags-dropdown-explorer', 'value'),
+            Input('tags-mode-explorer', 'value'),
+            Input('search-explorer', 'value'),
+            Input('pagination-explorer', 'active_page'),
+        ],
+        State('dataset-id', 'data'),
+        prevent_initial_call=True
     )
-    def update_articles_explorer(selected_tags):
-        """ This function updates the table in the explorer to showcase the
-        articles according to the selected tag/tags"""
-        global df
+    def update_articles_explorer(selected_tags, tags_mode, search_text,
+                                 active_page, dataset_id):
+        """ This function updates the table in the explorer to showcase a
+        page of the articles matching the search and the selected tag/tags.
+        Changing the filters goes back to the first page."""
+        df = fetch_dataset(dataset_id, EXPLORER_COLUMNS)
+        if df is None:
+            raise PreventUpdate
+
+        if ctx.triggered_id != 'pagination-explorer' or not active_page:
+            active_page = 1
+        search_text = (search_text or '').strip()
+        if search_text and not has_search_index(dataset_id):
+            build_search_index(
+                fetch_dataset(dataset_id, SEARCH_COLUMNS), dataset_id)
 
-        # Filter the DataFrame to select only the rows containing the tags
-        filtered_df = df[df['tags'].apply(
-            lambda x: any(tag in x for tag in selected_tags))]
+        # only the entries of the visible page are looked up: the search
+        # index ranks and pages its matches itself, and the rows filtered by
+        # tags are kept for the next pages
+        if search_text and not selected_tags:
+            n_rows = count_matches(dataset_id, search_text)
+            active_page = min(active_page, n_pages(n_rows))
+            rows = search(
+                dataset_id, search_text, PAGE_SIZE,
+                (active_page - 1) * PAGE_SIZE)
+        else:
+            if selected_tags:
+                rows = memo_rows(
+                    (dataset_id, tuple(sorted(selected_tags)), tags_mode,
+                     search_text),
+                    partial(
+                        filter_explorer_rows, dataset_id, df, selected_tags,
+                        tags_mode, search_text))
+            else:
+                rows = datasets.derive(
+                    dataset_id, 'collections_order', gen_collections_order,
+                    df)
+            n_rows = len(rows)
+            active_page = min(active_page, n_pages(n_rows))
+            rows = page_rows(rows, active_page)
 
-        return [gen_table_explorer(gen_df_sort_collections(filtered_df))]
+        return [
+            gen_table_explorer(df.iloc[rows]),
+            f"{n_rows} articles found",
+            n_pages(n_rows),
+            active_page]
 
     return app.server
@@ -0,0 +1,42 @@
+""" This script has the store of the values derived from the datasets, such as
+the cleaned descriptions, the languages or the indexes of the models. They
+are pickled on disk by dataset and code version, so every worker and session
+reuses them """
+import os
+import pickle
+from data_handler.cache_dir import CACHE_DIR, CACHE_VERSION, atomic_path
+from data_handler.cache_dir import touch
+
+# returned when an artifact was never stored
+MISSING = object()
+
+
+class ArtifactStore:
+    """ Keeps the derived values of each dataset in pickle files, named after
+    the dataset's content hash and the value's name"""
+
+    def __init__(self, path=None, version=CACHE_VERSION):
+        self.path = os.path.join(
+            path or os.path.join(CACHE_DIR, 'artifacts'), version)
+
+    def artifact_path(self, dataset_id, name):
+        """ Returns the path of an artifact"""
+        return os.path.join(self.path, dataset_id, f"{name}.pkl")
+
+    def get(self, dataset_id, name):
+        """ Returns an artifact, or MISSING if it is not stored or can not be
+        read. The folder of the dataset is marked as used."""
+        path = self.artifact_path(dataset_id, name)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return MISSING
+        touch(os.path.dirname(path))
+        return value
+
+    def set(self, dataset_id, name, value):
+        """ Stores an artifact, replacing the file once it is written"""
+        with atomic_path(self.artifact_path(dataset_id, name)) as tmp_path:
+            with open(tmp_path, 'wb') as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,98 @@
+""" This script has the manager of the background callbacks. The jobs run in
+processes of this machine, and their progress and results are kept in a disk
+cache shared by the workers, so the request threads stay free """
+import contextlib
+import os
+import diskcache
+import multiprocess
+import psutil
+from dash import DiskcacheManager
+from data_handler.cache_dir import CACHE_DIR, CACHE_VERSION
+
+JOBS_DIR = os.path.join(CACHE_DIR, 'jobs')
+
+# seconds the results of the jobs are kept after their last use
+RESULT_EXPIRE = int(os.getenv('POST3_JOB_EXPIRE', '3600'))
+
+# seconds after which the lock of a worker starting a job is released, in
+# case the worker died while holding it
+START_TIMEOUT = 60
+
+
+class SharedJobsManager(DiskcacheManager):
+    """ Diskcache manager that runs identical jobs once. A request for a job
+    whose result is cached does not start a process, and a request for a job
+    that is running waits for it. A shared job is only terminated when every
+    request waiting for it was cancelled. The jobs are forked by a server
+    process with a single thread, which imports the preloaded modules once:
+    forking a worker while its other threads use sqlite could leave the job
+    waiting forever on a lock of the cache. As with spawned processes, each
+    job runs the main script again, so it must guard what it starts."""
+
+    def __init__(self, cache, preload=(), **kwargs):
+        super().__init__(cache, **kwargs)
+        self.context = multiprocess.get_context('forkserver')
+        self.context.set_forkserver_preload(list(preload))
+
+    def call_job_fn(self, key, job_fn, args, context):
+        if self.result_ready(key):
+            return None
+
+        # the lock keeps two workers from starting the same job, without
+        # holding a transaction of the cache while the process is forked
+        with diskcache.Lock(self.handle, f"start-{key}", expire=START_TIMEOUT):
+            if self.result_ready(key):  # finished while waiting for the lock
+                return None
+            job = self.handle.get(f"job-{key}")
+            if job is not None and self.job_running(job):
+                self.handle.incr(f"waiters-{job}")
+                return job
+
+            job = self.start_job(key, job_fn, args, context)
+            self.handle.set(f"job-{key}", job, expire=RESULT_EXPIRE)
+            self.handle.set(f"waiters-{job}", 1, expire=RESULT_EXPIRE)
+        return job
+
+    def start_job(self, key, job_fn, args, context):
+        """ Starts a job in a process forked by the server, returning its
+        pid"""
+        process = self.context.Process(
+            target=job_fn,
+            args=(key, self._make_progress_key(key), args, context))
+        process.start()
+        return process.pid
+
+    def terminate_job(self, job):
+        if job is None:
+            return
+        with self.handle.transact():
+            waiters = self.handle.decr(f"waiters-{job}", default=1)
+            if waiters > 0:
+                return
+            self.handle.delete(f"waiters-{job}")
+        # the server reaps the jobs, which may exit while being terminated
+        with contextlib.suppress(psutil.NoSuchProcess):
+            super().terminate_job(job)
+
+    def terminate_unhealthy_job(self, job):
+        if job is None:
+            return False
+        return super().terminate_unhealthy_job(job)
+
+    def job_running(self, job):
+        # cached results are returned without a job
+        if job is None:
+            return False
+        try:
+            return super().job_running(job)
+        except psutil.NoSuchProcess:  # reaped meanwhile
+            return False
+
+
+def gen_background_manager(path=JOBS_DIR, expire=RESULT_EXPIRE, preload=()):
+    """ Returns the manager of the background callbacks. Their results are
+    cached by arguments and version of the caches, and the modules of the
+    callbacks are preloaded by the server forking the jobs."""
+    return SharedJobsManager(
+        diskcache.Cache(path), preload,
+        cache_by=[lambda: CACHE_VERSION], expire=expire)
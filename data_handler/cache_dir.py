@@ -0,0 +1,125 @@
+""" This script has the folder of the caches shared by the workers, the
+version of what they hold and the helper used to write their files
+atomically. The folder holds pickles, so it is only used if it belongs to
+this user and others can not write to it """
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+# bumped when the ingested columns change, so stale datasets are not used
+FORMAT_VERSION = 3
+
+# folder of the models computing what is cached from the datasets
+MODELS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models')
+
+
+def secure_dir(path):
+    """ Creates a folder only accessible to this user, or checks that an
+    existing one is owned by this user and not writable by others"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    owned = not hasattr(os, 'getuid') or info.st_uid == os.getuid()
+    if os.path.islink(path) or not owned or info.st_mode & 0o022:
+        raise PermissionError(
+            f"The cache folder {path} must be owned by this user and not "
+            "writable by others, set POST3_CACHE_DIR to another folder")
+    return path
+
+
+def sources_digest(path=MODELS_DIR):
+    """ Returns a digest of the python sources of a folder, so what was
+    cached is not reused once the code computing it changes"""
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(os.listdir(path)):
+        if name.endswith('.py'):
+            digest.update(name.encode('utf-8'))
+            with open(os.path.join(path, name), 'rb') as file:
+                digest.update(file.read())
+    return digest.hexdigest()
+
+
+# folder where the ingested datasets and what is derived from them are
+# cached, shared by the workers
+CACHE_DIR = secure_dir(os.getenv(
+    'POST3_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'post3_engine')))
+
+# version of the values derived from the datasets (artifacts, figures, word
+# clouds, search indexes and results of the jobs), changing with the format
+# of the datasets and the sources of the models
+MODELS_DIGEST = sources_digest()
+CACHE_VERSION = f"v{FORMAT_VERSION}-{MODELS_DIGEST}"
+DATASET_VERSION = f"v{FORMAT_VERSION}"
+
+# folders of the stores holding a file or folder per dataset, each in a
+# subfolder of the current version
+STORE_VERSIONS = {
+    'uploads': DATASET_VERSION,
+    'datasets': DATASET_VERSION,
+    'artifacts': CACHE_VERSION,
+    'search': CACHE_VERSION,
+    'wordclouds': CACHE_VERSION}
+
+# days after which the files of the stores that were not used are removed
+MAX_AGE = float(os.getenv('POST3_CACHE_MAX_AGE_DAYS', '7')) * 24 * 3600
+
+
+def touch(path):
+    """ Marks a cached file as used, so it is not pruned. Returns whether it
+    exists."""
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def remove_path(path):
+    """ Removes a file or folder, ignoring the ones removed meanwhile"""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def prune_cache(max_age=MAX_AGE):
+    """ Removes the folders of the previous versions of the stores, and the
+    files and folders of the current ones not modified for max_age
+    seconds"""
+    expired = time.time() - max_age
+    for store, version in STORE_VERSIONS.items():
+        root = os.path.join(CACHE_DIR, store)
+        if not os.path.isdir(root):
+            continue
+        for name in os.listdir(root):
+            if name != version:
+                remove_path(os.path.join(root, name))
+                continue
+            with os.scandir(os.path.join(root, name)) as entries:
+                for entry in entries:
+                    with contextlib.suppress(FileNotFoundError):
+                        if entry.stat(follow_symlinks=False).st_mtime < (
+                                expired):
+                            remove_path(entry.path)
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """ Yields a new temporary path in the folder of path, which replaces
+    path once the block is done, so other threads and workers never read a
+    partial file. The temporary file is removed if the block fails."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
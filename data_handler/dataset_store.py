@@ -0,0 +1,137 @@
+""" This script has the store that keeps the uploaded datasets in memory, so
+the callbacks of each session can fetch their own dataset by id """
+import os
+import threading
+import uuid
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from data_handler.artifact_store import MISSING
+
+# memory budget for the datasets held by each worker (in MB)
+MEMORY_BUDGET = int(os.getenv('POST3_STORE_BUDGET_MB', '512')) * 1024 ** 2
+
+
+def frame_size(df):
+    """ Returns the memory used by a dataframe, in bytes"""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def object_size(value):
+    """ Returns an estimate of the memory used by a derived value, in
+    bytes"""
+    if isinstance(value, pd.DataFrame):
+        return frame_size(value)
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(object_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(object_size(v) for v in value)
+    return 0
+
+
+class DatasetStore:
+    """ Keeps the parsed datasets by id, along with the values derived from
+    them. When the memory budget is exceeded the least recently used datasets
+    are evicted. The derived values can also be persisted to an artifact
+    store, shared with the other workers."""
+
+    def __init__(self, budget=MEMORY_BUDGET, artifacts=None):
+        self.budget = budget
+        self.artifacts = artifacts
+        self.size = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, dataset_id):
+        return dataset_id in self._frames
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, df, dataset_id=None):
+        """ Stores a dataframe and returns the id to fetch it later"""
+        if dataset_id is None:
+            dataset_id = uuid.uuid4().hex
+        size = frame_size(df)
+        with self._lock:
+            self._pop(dataset_id)
+            self._frames[dataset_id] = {'df': df, 'size': size, 'derived': {}}
+            self.size += size
+            self._evict()
+
+        return dataset_id
+
+    def get(self, dataset_id):
+        """ Returns the dataframe stored with the id, or None if it was
+        evicted or never uploaded to this worker"""
+        with self._lock:
+            if dataset_id not in self._frames:
+                return None
+            self._frames.move_to_end(dataset_id)
+            return self._frames[dataset_id]['df']
+
+    def add_columns(self, dataset_id, columns):
+        """ Adds the columns of a dataframe to a stored dataset, keeping the
+        values derived from it. Returns the extended dataframe, or None if the
+        dataset is not in the store."""
+        with self._lock:
+            entry = self._frames.get(dataset_id)
+            if entry is None:
+                return None
+            # another thread may have added some of them meanwhile
+            columns = columns.drop(
+                columns=[c for c in columns if c in entry['df'].columns])
+            size = frame_size(columns)
+            entry['df'] = pd.concat([entry['df'], columns], axis=1, copy=False)
+            entry['size'] += size
+            self.size += size
+            self._frames.move_to_end(dataset_id)
+            self._evict()
+            return entry['df']
+
+    def derive(self, dataset_id, name, func, df=None):
+        """ Returns a value derived from a dataset. It is computed with
+        func(df) the first time it is requested, or loaded from the artifact
+        store, and kept with the stored dataset afterwards. The dataframe
+        fetched by the caller is used if given, so the value is still
+        returned, without being kept, when another session evicted the
+        dataset meanwhile."""
+        with self._lock:
+            entry = self._frames.get(dataset_id)
+            if entry is not None and name in entry['derived']:
+                return entry['derived'][name]
+        if df is None:
+            if entry is None:
+                raise LookupError(dataset_id)
+            df = entry['df']
+
+        value = MISSING
+        if self.artifacts is not None:
+            value = self.artifacts.get(dataset_id, name)
+        if value is MISSING:
+            value = func(df)
+            if self.artifacts is not None:
+                self.artifacts.set(dataset_id, name, value)
+        size = object_size(value)
+        with self._lock:
+            # the dataset may have been evicted while computing
+            if entry is not None and self._frames.get(dataset_id) is entry:
+                entry['derived'][name] = value
+                entry['size'] += size
+                self.size += size
+                self._evict()
+
+        return value
+
+    def _pop(self, dataset_id):
+        if dataset_id in self._frames:
+            self.size -= self._frames.pop(dataset_id)['size']
+
+    def _evict(self):
+        # the newest dataset is kept even if it is above the budget
+        while self.size > self.budget and len(self._frames) > 1:
+            self._pop(next(iter(self._frames)))
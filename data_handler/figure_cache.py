@@ -0,0 +1,77 @@
+""" This script has the cache of the serialised figures and tables of the
+dashboards. It is kept in a sqlite database on disk, so it is shared by the
+workers """
+import contextlib
+import json
+import os
+import sqlite3
+import time
+import plotly
+from data_handler.cache_dir import CACHE_DIR, CACHE_VERSION
+
+# maximum number of figures and tables kept in the cache
+MAX_ENTRIES = int(os.getenv('POST3_FIGURE_CACHE_SIZE', '5000'))
+
+
+def figure_key(dataset_id, chart_id, *args):
+    """ Returns the cache key of a chart, for a dataset and the arguments
+    used to build it, e.g. the selected range"""
+    return ':'.join(
+        [CACHE_VERSION, dataset_id, chart_id] + [str(arg) for arg in args])
+
+
+class FigureCache:
+    """ Least recently used cache of figures and components serialised as
+    JSON, shared by the processes using the same database file"""
+
+    def __init__(self, path=None, max_entries=MAX_ENTRIES):
+        self.path = path or os.path.join(CACHE_DIR, 'figures.sqlite')
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS figures ('
+                'key TEXT PRIMARY KEY, value TEXT, accessed REAL)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS figures_accessed '
+                'ON figures (accessed)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:  # commits the transaction
+                yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, keys):
+        """ Returns the cached values of the keys, with None for the keys that
+        are not cached"""
+        with self._connect() as conn:
+            rows = dict(conn.execute(
+                'SELECT key, value FROM figures WHERE key IN '
+                f"({','.join('?' * len(keys))})", keys).fetchall())
+            if rows:
+                conn.executemany(
+                    'UPDATE figures SET accessed = ? WHERE key = ?',
+                    [(time.time(), key) for key in rows])
+
+        return [
+            json.loads(rows[key]) if key in rows else None for key in keys]
+
+    def set_many(self, items):
+        """ Serialises and stores a dictionary of keys and figures or
+        components, evicting the least recently used entries"""
+        now = time.time()
+        rows = [
+            (key, json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder), now)
+            for key, value in items.items()]
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO figures VALUES (?, ?, ?)', rows)
+            conn.execute(
+                'DELETE FROM figures WHERE key IN ('
+                'SELECT key FROM figures ORDER BY accessed DESC '
+                'LIMIT -1 OFFSET ?)', (self.max_entries,))
@@ -0,0 +1,278 @@
+""" This script has the functions to parse the uploaded datasets into typed
+dataframes and to keep them in a columnar cache on disk """
+import base64
+import contextlib
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+from data_handler.cache_dir import CACHE_DIR, DATASET_VERSION, atomic_path
+from data_handler.cache_dir import prune_cache, touch
+
+CATEGORICAL_COLUMNS = ['author', 'network']
+FLOAT_COLUMNS = ['revenue', 'price_usd']
+
+# units tried in order for numeric dates, as pandas' read_json does, so
+# epoch milliseconds (the default of to_json) are read as such
+EPOCH_UNITS = ['s', 'ms', 'us', 'ns']
+
+# records parsed at once when streaming json lines
+BATCH_SIZE = 5000
+
+# arrow types of the post3 columns, used to write the streamed batches
+SCHEMA = pa.schema([
+    ('title', pa.string()),
+    ('body', pa.string()),
+    ('description', pa.string()),
+    ('author', pa.string()),
+    ('author_link', pa.string()),
+    ('link', pa.string()),
+    ('tags', pa.list_(pa.string())),
+    ('date', pa.timestamp('ns')),
+    ('collections', pa.int64()),
+    ('revenue', pa.float64()),
+    ('network', pa.string()),
+    ('price_usd', pa.float64())])
+
+
+def content_hash(content_string):
+    """ Returns a digest of the uploaded content, used as the dataset id"""
+    return hashlib.blake2b(
+        content_string.encode('ascii'), digest_size=16).hexdigest()
+
+
+def is_json_lines(filename):
+    """ Checks if the uploaded file is in the json lines format, optionally
+    gzipped"""
+    return any(ext in filename for ext in ['.jsonl', '.ndjson'])
+
+
+def parse_dates(values):
+    """ Parses a column of dates as pandas' read_json does: numbers are epoch
+    timestamps in the first unit that fits, and strings with a timezone give
+    timezone aware dates"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    numbers = pd.to_numeric(values, errors='coerce')
+    if values.notna().any() and numbers.notna().sum() == values.notna().sum():
+        for unit in EPOCH_UNITS:
+            try:
+                return pd.to_datetime(numbers, unit=unit)
+            except (ValueError, OverflowError):
+                continue
+    dates = pd.to_datetime(values)
+    if dates.dtype == object:  # several offsets
+        dates = pd.to_datetime(values, utc=True)
+    return dates
+
+
+def align_timezone(dates, tz):
+    """ Converts dates to a timezone, or to naive UTC dates if tz is None"""
+    if dates.dt.tz is None:
+        return dates if tz is None else dates.dt.tz_localize(tz)
+    return dates.dt.tz_convert(tz)
+
+
+def normalise_frame(df, categorical=True):
+    """ Fixes the types of the columns used by the models"""
+    if 'date' in df.columns:
+        df['date'] = parse_dates(df['date'])
+    if 'collections' in df.columns:
+        df['collections'] = pd.to_numeric(df['collections'], errors='coerce')
+    for column in FLOAT_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(
+                df[column], errors='coerce').astype('float64')
+    for column in CATEGORICAL_COLUMNS:
+        if categorical and column in df.columns:
+            df[column] = df[column].astype('category')
+    if 'tags' in df.columns:
+        df['tags'] = df['tags'].apply(
+            lambda x: x if isinstance(x, list)
+            else [x] if isinstance(x, str) else [])
+    return df
+
+
+def parse_upload(raw):
+    """ Parses a binary file object with the content of a json upload into a
+    dataframe"""
+    # the bytes are parsed directly, without an intermediate decoded str
+    return normalise_frame(pd.read_json(raw))
+
+
+def upload_path(dataset_id):
+    """ Returns the path of the content of an upload waiting to be
+    ingested"""
+    return os.path.join(CACHE_DIR, 'uploads', DATASET_VERSION, dataset_id)
+
+
+def spool_upload(content_string, dataset_id):
+    """ Writes the decoded content of an upload to disk, from where the
+    background job ingesting it reads it"""
+    with atomic_path(upload_path(dataset_id)) as tmp_path:
+        with open(tmp_path, 'wb') as file:
+            file.write(base64.b64decode(content_string))
+
+
+def dataset_path(dataset_id):
+    """ Returns the path of the columnar file of a dataset"""
+    return os.path.join(
+        CACHE_DIR, 'datasets', DATASET_VERSION, f"{dataset_id}.arrow")
+
+
+def write_dataset(df, dataset_id):
+    """ Writes a typed dataframe to the columnar cache. The file is left
+    uncompressed so it can be memory-mapped when read."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with atomic_path(dataset_path(dataset_id)) as tmp_path:
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+
+
+def dataset_columns(dataset_id):
+    """ Returns the names of the columns of a cached dataset, from the
+    schema of its file. Returns None if it is not cached."""
+    path = dataset_path(dataset_id)
+    if not touch(path):
+        return None
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).schema.names
+
+
+def read_dataset(dataset_id, columns=None):
+    """ Reads a dataset from the columnar cache, memory-mapping the file and
+    loading only the requested columns. Returns None if it is not cached."""
+    path = dataset_path(dataset_id)
+    if not touch(path):
+        return None
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    df = table.to_pandas(split_blocks=True)
+
+    # streamed datasets are written with plain strings
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns and df[column].dtype == object:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def iter_json_lines(raw, batch_size=BATCH_SIZE):
+    """ Yields lists of at most batch_size records from a binary file object
+    in the json lines format. Gzipped content is decompressed on the fly."""
+    if raw.peek(2)[:2] == b'\x1f\x8b':
+        raw = gzip.GzipFile(fileobj=raw)
+    records = []
+    for line in io.TextIOWrapper(raw, encoding='utf-8'):
+        line = line.strip()
+        if not line:
+            continue
+        records.append(json.loads(line))
+        if len(records) == batch_size:
+            yield records
+            records = []
+    if records:
+        yield records
+
+
+def batch_to_table(records, schema):
+    """ Converts a batch of records into an arrow table with the given
+    schema"""
+    df = pd.DataFrame.from_records(records, columns=schema.names)
+    df = normalise_frame(df, categorical=False)
+    if 'date' in df.columns:
+        df['date'] = align_timezone(df['date'], schema.field('date').type.tz)
+    if 'collections' in df.columns:
+        df['collections'] = df['collections'].astype('Int64')
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    return table.replace_schema_metadata(None)
+
+
+def extra_fields(records):
+    """ Returns the arrow fields of the keys of the records that are not
+    post3 columns, with the types inferred from their values"""
+    keys = [
+        key for key in dict.fromkeys(
+            key for record in records for key in record)
+        if key not in SCHEMA.names]
+    if not keys:
+        return []
+    schema = pa.Table.from_pylist(
+        [{key: record.get(key) for key in keys} for record in records]).schema
+    return [
+        pa.field(field.name, pa.string())
+        if pa.types.is_null(field.type) else field
+        for field in schema]
+
+
+def ingest_json_lines(raw, dataset_id, batch_size=BATCH_SIZE, progress=None):
+    """ Streams a json lines file object into the columnar cache, one batch
+    of records at a time, so neither the whole text nor all the records are
+    held in memory. The optional progress function is called with the number
+    of rows written after each batch."""
+    batches = iter_json_lines(io.BufferedReader(raw), batch_size)
+    first = next(batches, [])
+
+    # every post3 column is written, missing values being null, along with
+    # the other keys of the first batch, and the dates are stored in UTC if
+    # those of the first batch have a timezone
+    schema = pa.schema(list(SCHEMA) + extra_fields(first))
+    dates = parse_dates(pd.Series([record.get('date') for record in first]))
+    if dates.dt.tz is not None:
+        schema = schema.set(
+            schema.get_field_index('date'),
+            pa.field('date', pa.timestamp('ns', tz='UTC')))
+    names = set(schema.names)
+    n_rows = 0
+    with atomic_path(dataset_path(dataset_id)) as tmp_path:
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                for records in itertools.chain([first], batches):
+                    if not records:
+                        continue
+                    unknown = set().union(*records) - names
+                    if unknown:
+                        raise ValueError(
+                            f"The keys {', '.join(sorted(unknown))} only "
+                            f"appear after the first {batch_size} records, "
+                            "upload the dataset as json instead")
+                    writer.write_table(batch_to_table(records, schema))
+                    n_rows += len(records)
+                    if progress is not None:
+                        progress(n_rows)
+
+    return n_rows
+
+
+def ingest_file(raw, dataset_id, filename='', progress=None):
+    """ Writes the content of an upload, read from a binary file object, to
+    the columnar cache. The progress function is passed on to the ingestion
+    of json lines files."""
+    if is_json_lines(filename):
+        ingest_json_lines(raw, dataset_id, progress=progress)
+    else:
+        write_dataset(parse_upload(raw), dataset_id)
+
+
+def ingest_spooled(dataset_id, filename='', progress=None):
+    """ Ingests an upload written by spool_upload, unless the same content
+    was already ingested, and removes the spooled content, even if it can
+    not be parsed. Returns whether the dataset is in the columnar cache.
+    The files of the caches that were not used lately are pruned once a new
+    dataset is written."""
+    path = upload_path(dataset_id)
+    try:
+        if not touch(dataset_path(dataset_id)):
+            try:
+                raw = open(path, 'rb')
+            except FileNotFoundError:
+                return False
+            with raw:
+                ingest_file(raw, dataset_id, filename, progress)
+            prune_cache()
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+    return True
@@ -0,0 +1,89 @@
+""" This script has the full-text search index of the explorer. Each dataset
+gets a sqlite FTS5 index on disk, built when it is ingested and shared by the
+workers and sessions """
+import contextlib
+import os
+import sqlite3
+import numpy as np
+from data_handler.cache_dir import CACHE_DIR, CACHE_VERSION, atomic_path
+from data_handler.cache_dir import touch
+
+SEARCH_DIR = os.path.join(CACHE_DIR, 'search', CACHE_VERSION)
+
+# bm25 weights of the title, description and body columns
+WEIGHTS = (10.0, 5.0, 1.0)
+
+
+def search_index_path(dataset_id):
+    """ Returns the path of the search index of a dataset"""
+    return os.path.join(SEARCH_DIR, f"{dataset_id}.sqlite")
+
+
+def has_search_index(dataset_id):
+    """ Checks if the search index of a dataset was built, marking it as
+    used"""
+    return touch(search_index_path(dataset_id))
+
+
+def build_search_index(df, dataset_id):
+    """ Indexes the titles, descriptions and bodies of a dataset. The
+    index is contentless: it only maps the terms to the entries'
+    positions."""
+    rows = zip(
+        range(len(df)),
+        df['title'].fillna(''),
+        df['description'].fillna(''),
+        df['body'].fillna(''))
+    with atomic_path(search_index_path(dataset_id)) as tmp_path:
+        with contextlib.closing(sqlite3.connect(tmp_path)) as conn:
+            with conn:
+                conn.execute(
+                    'CREATE VIRTUAL TABLE articles USING fts5('
+                    "title, description, body, content='', "
+                    "tokenize='unicode61 remove_diacritics 2')")
+                conn.executemany(
+                    'INSERT INTO articles (rowid, title, description, body) '
+                    'VALUES (?, ?, ?, ?)', rows)
+                conn.execute(
+                    "INSERT INTO articles (articles) VALUES ('optimize')")
+
+
+def to_match_query(text):
+    """ Converts the text typed by the user into an FTS5 query matching all
+    its words, the last one as a prefix"""
+    words = ['"' + word.replace('"', '""') + '"' for word in text.split()]
+    if words:
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+def connect_index(dataset_id):
+    """ Opens the search index of a dataset in read-only mode"""
+    uri = f"file:{search_index_path(dataset_id)}?mode=ro"
+    return contextlib.closing(sqlite3.connect(uri, uri=True))
+
+
+def count_matches(dataset_id, text):
+    """ Returns the number of entries matching the text"""
+    query = to_match_query(text)
+    if not query:
+        return 0
+    with connect_index(dataset_id) as conn:
+        return conn.execute(
+            'SELECT COUNT(*) FROM articles WHERE articles MATCH ?',
+            (query,)).fetchone()[0]
+
+
+def search(dataset_id, text, limit=-1, offset=0):
+    """ Returns the positions of the entries matching the text, ranked by
+    bm25, optionally paginated with limit and offset"""
+    query = to_match_query(text)
+    if not query:
+        return np.empty(0, dtype=np.int64)
+    with connect_index(dataset_id) as conn:
+        rows = conn.execute(
+            'SELECT rowid FROM articles WHERE articles MATCH ? '
+            f"ORDER BY bm25(articles, {', '.join(map(str, WEIGHTS))}) "
+            'LIMIT ? OFFSET ?', (query, limit, offset)).fetchall()
+
+    return np.array([row[0] for row in rows], dtype=np.int64)
@@ -0,0 +1,34 @@
+""" This script keeps the images of the word clouds in a cache on disk, from
+where they are served by the app. They are rendered by the background job
+building the textual layout, so the web workers never draw them """
+import os
+from data_handler.cache_dir import CACHE_DIR, CACHE_VERSION, atomic_path
+from data_handler.cache_dir import touch
+
+WORDCLOUD_DIR = os.path.join(CACHE_DIR, 'wordclouds', CACHE_VERSION)
+
+
+def wordcloud_path(dataset_id, name):
+    """ Returns the path of the cached image of a word cloud"""
+    return os.path.join(WORDCLOUD_DIR, f"{dataset_id}-{name}.png")
+
+
+def cache_wordcloud(dataset_id, name, render):
+    """ Writes the PNG bytes returned by render to the cache, unless the
+    word cloud is cached already or render returns None"""
+    path = wordcloud_path(dataset_id, name)
+    if touch(path):
+        return
+    image = render()
+    if image is None:
+        return
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, 'wb') as file:
+            file.write(image)
+
+
+def cached_wordcloud(dataset_id, name):
+    """ Returns the path of the cached image of a word cloud, or None if it
+    was not rendered"""
+    path = wordcloud_path(dataset_id, name)
+    return path if touch(path) else None
@@ -1,265 +1,250 @@
 """ Script to launch the charts about collections and revenue """
-import plotly.graph_objects as go
-from dash import html, dcc
+import os
+from dash import html, dcc, Patch
+import numpy as np
 import pandas as pd
-
-
-def gen_df_sort_collections(df):
-    """ Make dataframe sorted by collections"""
-    df = df.sort_values(by='collections', ascending=False)
-    df['revenue'] = round(df['revenue'], 4)
-    return df
-
-
-def gen_df_sort_revenue(df):
-    """ Make dataframe sorted by revenue"""
-    df = df.sort_values(by='revenue', ascending=False)
-    df['revenue'] = round(df['revenue'], 4)
-    return df
-
-
-def create_collections_authors_figure(df):
-    """ Create collections per authors/publications bar plot"""
-    revenue = 'ETH'
-    if 'price_usd' in df.columns:
-        revenue = 'USD'
-    df = df.head(10)
-    data = go.Bar(
-            x=df['collections'],
-            y=df['author'],
-            meta=df['revenue'],
-            hovertemplate="""<br>Author/Publication: %{y}
+from models.date_index import gen_date_index, gen_buckets, gen_marks
+from models.date_index import LABEL_FORMATS
+from models.figures import gen_figure, bar_layout, colorbar_marker, hbar
+from models.figures import color_range, DEFAULT_TEMPLATE, MARGIN
+
+TOP_K = 10  # number of leaders shown in the charts and tables
+
+# datasets with up to this number of (day, author) statistics are filtered
+# by the range slider in the browser (0 always filters on the server)
+CLIENTSIDE_MAX_STATS = int(os.getenv('POST3_CLIENTSIDE_MAX_STATS', '20000'))
+
+
+def gen_top_k(df, by, k=TOP_K):
+    """ Select the k entries with the highest values of the given column,
+    without sorting the whole dataframe"""
+    df = df.nlargest(k, by)
+    return df.assign(revenue=round(df['revenue'], 4))
+
+
+def revenue_unit(df):
+    """ Returns the currency of the revenue column, in USD if the entries
+    have prices in USD"""
+    if 'price_usd' in df.columns and df['price_usd'].notna().any():
+        return 'USD'
+    return 'ETH'
+
+
+def gen_sorted_views(df, k=TOP_K):
+    """ Precompute, for collections and revenue, the ranking of the entries
+    and the ranks of the k leaders of each day"""
+    date_index = gen_date_index(df)
+    date_pos = date_index['positions']
+    counts = np.bincount(date_pos, minlength=len(date_index['days']))
+    starts = np.cumsum(counts) - counts
+
+    views = {}
+    for column in ['collections', 'revenue']:
+        # stable descending order, leaving missing values at the end
+        order = np.argsort(-df[column].to_numpy(), kind='stable')
+
+        # global ranks grouped by date, ascending within each date
+        ranks = np.argsort(date_pos[order], kind='stable')
+        pos_in_date = np.arange(len(ranks)) - np.repeat(starts, counts)
+        views[column] = {
+            'order': order,
+            'top_ranks': ranks[pos_in_date < k],
+            'offsets': np.concatenate(
+                [[0], np.cumsum(np.minimum(counts, k))])}
+    return views
+
+
+def select_top_k(df, views, by, start, end, k=TOP_K):
+    """ Select the k leaders between two day positions, the end excluded, by
+    merging the leaders precomputed for each day"""
+    view = views[by]
+    offsets = view['offsets']
+    end = min(end, len(offsets) - 1)
+    ranks = view['top_ranks'][offsets[min(start, end)]:offsets[end]]
+    if len(ranks) > k:
+        ranks = np.partition(ranks, k - 1)[:k]
+    df = df.iloc[view['order'][np.sort(ranks)]]
+    return df.assign(revenue=round(df['revenue'], 4))
+
+
+def gen_author_stats(df):
+    """ Aggregate the collections, revenue and number of entries of each
+    author/publication per day. The result is sorted by day position."""
+    date_pos = gen_date_index(df)['positions']
+    stats = df[['author', 'collections', 'revenue']].assign(
+        date_pos=date_pos, entries=1)
+    stats = stats.groupby(
+        ['date_pos', 'author'], observed=True, sort=True).sum()
+    return stats.reset_index()
+
+
+def select_authors_top_k(stats, by, start, end, k=TOP_K):
+    """ Sum the statistics of each author/publication between two day
+    positions, the end excluded, and select the k leaders"""
+    lo, hi = np.searchsorted(stats['date_pos'].to_numpy(), [start, end])
+    authors = stats.iloc[lo:hi].groupby('author', observed=True)[
+        ['collections', 'revenue', 'entries']].sum()
+    authors = authors.reset_index().nlargest(k, by)
+    return authors.assign(revenue=round(authors['revenue'], 4))
+
+
+def to_list(values):
+    """ Converts an array to a list for JSON, with None for missing
+    values"""
+    values = pd.Series(values)
+    return values.astype(object).where(values.notna(), None).tolist()
+
+
+def gen_range_summary(df, views, stats, k=TOP_K):
+    """ Compact summary of the collections and revenue per day, from which
+    the browser ranks the leaders of any range of the slider: the statistics
+    of each author per day, and the k leaders of each day with their global
+    rank"""
+    n_days = len(views['collections']['offsets']) - 1
+    codes, names = pd.factorize(stats['author'], sort=True)
+    summary = {
+        'k': k,
+        'authors': {
+            'names': list(names),
+            'offsets': np.searchsorted(
+                stats['date_pos'].to_numpy(), np.arange(n_days + 1)).tolist(),
+            'author': codes.tolist(),
+            'collections': to_list(stats['collections']),
+            'revenue': to_list(stats['revenue']),
+            'entries': to_list(stats['entries'])}}
+
+    for by in ['collections', 'revenue']:
+        view = views[by]
+        ranks = view['top_ranks']
+        leaders = df.iloc[view['order'][ranks]]
+        summary[by] = {
+            'offsets': view['offsets'].tolist(),
+            'rank': ranks.tolist(),
+            'title': to_list(leaders['title']),
+            'link': to_list(leaders['link']),
+            'author': to_list(leaders['author']),
+            'collections': to_list(leaders['collections']),
+            'revenue': to_list(round(leaders['revenue'], 4))}
+    return summary
+
+
+def short_labels(titles):
+    """ Shortens the titles to 10 characters for the axis labels"""
+    return [
+        title[:10] + '...' if len(title) > 10
+        else title for title in titles]
+
+
+def author_bars(df, by):
+    """ Returns the bars of the chart of the authors/publications with the
+    most collections or revenue, coloured by the other column"""
+    other = 'revenue' if by == 'collections' else 'collections'
+    df = df.head(TOP_K)
+    return {
+        'x': df[by],
+        'y': df['author'],
+        'meta': df[other],
+        'customdata': df['entries'],
+        'color': df[other]}
+
+
+def entry_bars(df, by):
+    """ Returns the bars of the chart of the entries with the most
+    collections or revenue, coloured by the other column"""
+    other = 'revenue' if by == 'collections' else 'collections'
+    df = df.head(TOP_K)
+    return {
+        'x': df[by],
+        'y': short_labels(df['title']),
+        'meta': df['author'],
+        'customdata': df['title'],
+        'color': df[other]}
+
+
+def patch_bars(bars):
+    """ Returns a partial update of a bar chart that only replaces its bars,
+    leaving the layout and the colour bar of the figure alone"""
+    patch = Patch()
+    trace = patch['data'][0]
+    for key in ['x', 'y', 'meta', 'customdata']:
+        trace[key] = to_list(bars[key])
+    trace['marker']['color'] = to_list(bars['color'])
+    trace['marker']['cmin'], trace['marker']['cmax'] = color_range(
+        bars['color'])
+    return patch
+
+
+def create_collections_authors_figure(df, revenue='ETH'):
+    """ Create collections per authors/publications bar plot, from the
+    statistics summed per author"""
+    bars = author_bars(df, 'collections')
+    data = hbar(
+        bars['x'], bars['y'],
+        """<br>Author/Publication: %{y}
             <br>Collections:%{x}
             <br>Revenue:%{meta}
+            <br>Entries:%{customdata}
             <extra></extra>""",
-            orientation='h',
-            marker=dict(
-                color=df['revenue'],  # Use 'Revenue' values as the color
-                colorscale='peach',  # Choose a color scale
-                cmin=df['revenue'].min(),
-                cmax=df['revenue'].max(),
-                colorbar=dict(
-                    thickness=15,
-                    title=f"Revenue ({revenue})")))
-
-    layout = go.Layout(
-                margin=dict(l=20, r=20, t=20, b=20),
-                bargap=0.1,
-                bargroupgap=0.1,
-                showlegend=False,  # table being used for legend
-                template='plotly_white',
-                yaxis=dict(
-                    title='Authors',
-                    title_standoff=40,
-                    showgrid=False,
-                    side='left'),
-                xaxis=dict(
-                    title='Collections',
-                    autorange=True,
-                    showgrid=False))
-
-    fig = go.Figure({'data': data, 'layout': layout})
-    fig.update_layout(
-        yaxis={'categoryorder': 'total ascending'},
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        font=dict(
-            family="Courier New, monospace",
-            size=18,
-            color="white")
-        )
-    return fig
-
-
-def create_collections_entries_figure(df):
+        meta=np.asarray(bars['meta']),
+        customdata=np.asarray(bars['customdata']),
+        marker=colorbar_marker(bars['color'], f"Revenue ({revenue})"))
+
+    return gen_figure([data], bar_layout('Collections', 'Authors'))
+
+
+def create_collections_entries_figure(df, revenue='ETH'):
     """ Create collections per entries bar plot"""
-    revenue = 'ETH'
-    if 'price_usd' in df.columns:
-        revenue = 'USD'
-    df = df.head(10)
-    short_labels = [
-        title[:10] + '...' if len(title) > 10
-        else title for title in df['title']]
-    data = go.Bar(
-            x=df['collections'],
-            y=short_labels,
-            meta=df['author'],
-            customdata=df['title'],
-            hovertemplate="""<br>Title: %{customdata}
+    bars = entry_bars(df, 'collections')
+    data = hbar(
+        bars['x'], bars['y'],
+        """<br>Title: %{customdata}
             <br>Author: %{meta}
             <br>Collections: %{x}
             <extra></extra>""",
-            orientation='h',
-            marker=dict(
-                color=df['revenue'],  # Use 'Revenue' values as the color
-                colorscale='peach',  # Choose a color scale
-                cmin=df['revenue'].min(),
-                cmax=df['revenue'].max(),
-                colorbar=dict(
-                    thickness=15,
-                    title=f"Revenue ({revenue})")))
-
-    layout = go.Layout(
-                margin=dict(l=20, r=20, t=20, b=20),
-                bargap=0.1,
-                bargroupgap=0.1,
-                showlegend=False,  # table being used for legend
-                template='plotly_white',
-                yaxis=dict(
-                    title='Entries',
-                    title_standoff=40,
-                    showgrid=False,
-                    side='left'),
-                xaxis=dict(
-                    title='Collections',
-                    autorange=True,
-                    showgrid=False))
-
-    fig = go.Figure({'data': data, 'layout': layout})
-    fig.update_layout(
-        yaxis={'categoryorder': 'total ascending'},
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        font=dict(
-            family="Courier New, monospace",
-            size=18,
-            color="white")
-        )
-
-    return fig
-
-
-def create_revenue_authors_figure(df):
-    """ Create revenue per authors/publications bar plot"""
-    revenue = 'ETH'
-    if 'price_usd' in df.columns:
-        revenue = 'USD'
-    df = df.head(10)
-    data = go.Bar(
-            x=df['revenue'],
-            y=df['author'],
-            meta=df['collections'],
-            hovertemplate="""<br>Author/Publication: %{y}
+        meta=np.asarray(bars['meta']),
+        customdata=np.asarray(bars['customdata']),
+        marker=colorbar_marker(bars['color'], f"Revenue ({revenue})"))
+
+    return gen_figure([data], bar_layout('Collections', 'Entries'))
+
+
+def create_revenue_authors_figure(df, revenue='ETH'):
+    """ Create revenue per authors/publications bar plot, from the statistics
+    summed per author"""
+    bars = author_bars(df, 'revenue')
+    data = hbar(
+        bars['x'], bars['y'],
+        """<br>Author/Publication: %{y}
             <br>Revenue:%{x}
             <br>Collections:%{meta}
+            <br>Entries:%{customdata}
             <extra></extra>""",
-            orientation='h',
-            marker=dict(
-                color=df['collections'],
-                colorscale='peach',  # Choose a color scale
-                cmin=df['collections'].min(),
-                cmax=df['collections'].max(),
-                colorbar=dict(
-                    thickness=15,
-                    title='Collections')))
-
-    layout = go.Layout(
-                margin=dict(l=20, r=20, t=20, b=20),
-                bargap=0.1,
-                bargroupgap=0.1,
-                showlegend=False,  # table being used for legend
-                template='plotly_white',
-                yaxis=dict(
-                    title='Authors',
-                    title_standoff=40,
-                    showgrid=False,
-                    side='left'),
-                xaxis=dict(
-                    title=f"Revenue ({revenue})",
-                    autorange=True,
-                    showgrid=False))
-
-    fig = go.Figure({'data': data, 'layout': layout})
-    fig.update_layout(
-        yaxis={'categoryorder': 'total ascending'},
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        font=dict(
-            family="Courier New, monospace",
-            size=18,
-            color="white")
-        )
-
-    return fig
-
-
-def create_revenue_entries_figure(df):
-    """ Create revenue per entries bar plot"""
-    revenue = 'ETH'
-    if 'price_usd' in df.columns:
-        revenue = 'USD'
-    df = df.head(10)
+        meta=np.asarray(bars['meta']),
+        customdata=np.asarray(bars['customdata']),
+        marker=colorbar_marker(bars['color'], 'Collections'))
 
-    short_labels = [
-        title[:10] + '...' if len(title) > 10
-        else title for title in df['title']]
-    data = go.Bar(
-            x=df['revenue'],
-            y=short_labels,
-            meta=df['author'],
-            customdata=df['title'],
-            hovertemplate="""<br>Title: %{customdata}
+    return gen_figure([data], bar_layout(f"Revenue ({revenue})", 'Authors'))
+
+
+def create_revenue_entries_figure(df, revenue='ETH'):
+    """ Create revenue per entries bar plot"""
+    bars = entry_bars(df, 'revenue')
+    data = hbar(
+        bars['x'], bars['y'],
+        """<br>Title: %{customdata}
             <br>Author: %{meta}
             <br>Revenue: %{x}
             <extra></extra>""",
-            orientation='h',
-            marker=dict(
-                color=df['collections'],
-                colorscale='peach',
-                cmin=df['collections'].min(),
-                cmax=df['collections'].max(),
-                colorbar=dict(
-                    thickness=15,
-                    title='Collections')))
-
-    layout = go.Layout(
-                margin=dict(l=20, r=20, t=20, b=20),
-                bargap=0.1,
-                bargroupgap=0.1,
-                showlegend=False,  # table being used for legend
-                template='plotly_white',
-                yaxis=dict(
-                    title='Entries',
-                    title_standoff=40,
-                    showgrid=False,
-                    side='left'),
-                xaxis=dict(
-                    title=f"Revenue ({revenue})",
-                    autorange=True,
-                    showgrid=False))
-
-    fig = go.Figure({'data': data, 'layout': layout})
-    fig.update_layout(
-        yaxis={'categoryorder': 'total ascending'},
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        font=dict(
-            family="Courier New, monospace",
-            size=18,
-            color="white")
-        )
-
-    return fig
+        meta=np.asarray(bars['meta']),
+        customdata=np.asarray(bars['customdata']),
+        marker=colorbar_marker(bars['color'], 'Collections'))
+
+    return gen_figure([data], bar_layout(f"Revenue ({revenue})", 'Entries'))
 
 
 def create_pie_networks(df):
     """ create pie plot to compare networks usage"""
     network_counts = df['network'].value_counts()
-    data = go.Pie(
-        labels=list(network_counts.index),
-        values=list(network_counts.values),
-        hovertemplate="""<br>Network: %{label}
-        <br>Count: %{value}
-        <br>Percentage: %{percent}
-        <extra></extra>
-        """
-    )
-
-    layout = go.Layout(
-        margin={'l': 20, 'r': 20, 't': 20, 'b': 20},
-        legend={'y': 0.5, 'x': 0.8},
-        legend_title_text='Networks')
-
     colors_traces = [
         '#ffac05',
         '#ffbc36',
@@ -268,17 +253,23 @@ def create_pie_networks(df):
         '#ffeecd',
         '#ffffff']
 
-    fig = go.Figure({'data': data, 'layout': layout})
-    fig.update_traces(marker={'colors': colors_traces})
-    fig.update_layout(
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        font=dict(
-            family="Courier New, monospace",
-            size=18,
-            color="white")
-        )
-    return fig
+    data = {
+        'type': 'pie',
+        'labels': network_counts.index.to_numpy(),
+        'values': network_counts.to_numpy(),
+        'marker': {'colors': colors_traces},
+        'hovertemplate': """<br>Network: %{label}
+        <br>Count: %{value}
+        <br>Percentage: %{percent}
+        <extra></extra>
+        """}
+
+    layout = {
+        'margin': MARGIN,
+        'legend': {'y': 0.5, 'x': 0.8, 'title': {'text': 'Networks'}},
+        'template': DEFAULT_TEMPLATE}
+
+    return gen_figure([data], layout)
 
 
 def gen_table(df):
@@ -287,7 +278,7 @@ def gen_table(df):
         i+1: {'title': title, 'link': link}
         for i, (title, link)
         in enumerate(zip(
-            df.head(10).title.values, df.head(10).link.values))}
+            df.head(TOP_K).title.values, df.head(TOP_K).link.values))}
 
     rows = []
     for k, v in categories_dict.items():
@@ -310,28 +301,71 @@ def gen_table(df):
     return table_body
 
 
-# layout for collections and revenue
-def gen_layout_col_rev(df):
-    """ Generate Layout For the Collections and revenue Charts"""
-
-    df_collected = gen_df_sort_collections(df)
-    df_revenue = gen_df_sort_revenue(df)
+def gen_granularities(date_index):
+    """ Returns the bucket bounds and slider marks of each granularity, so
+    the browser switches between them without a request"""
+    granularities = {}
+    for granularity in LABEL_FORMATS:
+        buckets = gen_buckets(date_index, granularity)
+        granularities[granularity] = {
+            'bounds': buckets['bounds'].tolist(),
+            'marks': gen_marks(buckets)}
+    return granularities
 
-    # Convert the string dates to datetime objects
-    df['date'] = pd.to_datetime(df['date'])
 
-    # Format the datetime objects as strings in the desired format
-    df['date'] = df['date'].dt.strftime('%d-%m-%y')
+# layout for collections and revenue
+def gen_layout_col_rev(df, derive=None):
+    """ Generate Layout For the Collections and revenue Charts. The derive
+    function caches the values computed from the dataset, such as the
+    statistics per author"""
+    derive = derive or (lambda name, func: func(df))
+
+    df_collected = gen_top_k(df, 'collections')
+    df_revenue = gen_top_k(df, 'revenue')
+    author_stats = derive('author_stats', gen_author_stats)
+    date_index = derive('date_index', gen_date_index)
+    buckets = gen_buckets(date_index, 'day')
+    n_dates = len(date_index['days'])
+
+    # the slider of small datasets is filtered in the browser, from a
+    # summary per day shipped once with the layout
+    clientside = len(author_stats) <= CLIENTSIDE_MAX_STATS
+    suffix = '-client' if clientside else ''
+    controls = [
+        dcc.RadioItems(
+            id=f"granularity-col-rev{suffix}",
+            options=[
+                {'label': 'Days', 'value': 'day'},
+                {'label': 'Weeks', 'value': 'week'},
+                {'label': 'Months', 'value': 'month'}],
+            value='day',
+            inline=True,
+            className='tags-mode'
+        ),
+        dcc.RangeSlider(
+            id=f"slider-collections-authors{suffix}",
+            min=0,
+            max=len(buckets['starts']) - 1,
+            marks=gen_marks(buckets),
+            step=1,
+            value=[0, len(buckets['starts']) - 1],
+            className='range-slider',
+        )]
+    if clientside:
+        controls += [
+            dcc.Store(
+                id='summary-col-rev',
+                data=gen_range_summary(
+                    df, derive('sorted_views', gen_sorted_views),
+                    author_stats)),
+            dcc.Store(
+                id='granularities-col-rev',
+                data=gen_granularities(date_index)),
+            dcc.Store(id='buckets-col-rev', data=buckets['bounds'].tolist())]
 
     layout = dcc.Loading([
                 html.Div([
-                    dcc.RangeSlider(
-                        id='slider-collections-authors',
-                        marks=sorted(df['date'].unique()),
-                        step=1,
-                        value=[0, len(df['date'].unique())],
-                        className='range-slider',
-                    ),
+                    *controls,
                     html.Div([
                         html.Div([
                             html.H1(
@@ -342,7 +376,10 @@ def gen_layout_col_rev(df):
                             dcc.Graph(
                                 id="graph-collections-authors",
                                 figure=create_collections_authors_figure(
-                                    df_collected),
+                                    select_authors_top_k(
+                                        author_stats, 'collections',
+                                        0, n_dates),
+                                    revenue_unit(df)),
                                 style={
                                     'width': '80vw',
                                     'height': '70vw',
@@ -355,7 +392,9 @@ def gen_layout_col_rev(df):
                             dcc.Graph(
                                 id="graph-revenue-authors",
                                 figure=create_revenue_authors_figure(
-                                    df_revenue),
+                                    select_authors_top_k(
+                                        author_stats, 'revenue', 0, n_dates),
+                                    revenue_unit(df)),
                                 style={
                                     'width': '80vw',
                                     'height': '70vw',
@@ -371,7 +410,7 @@ def gen_layout_col_rev(df):
                             dcc.Graph(
                                 id="graph-collections-entries",
                                 figure=create_collections_entries_figure(
-                                    df_collected),
+                                    df_collected, revenue_unit(df)),
                                 style={
                                     'width': '80vw',
                                     'height': '70vw',
@@ -395,7 +434,7 @@ def gen_layout_col_rev(df):
                             dcc.Graph(
                                 id="graph-revenue-entries",
                                 figure=create_revenue_entries_figure(
-                                    df_revenue),
+                                    df_revenue, revenue_unit(df)),
                                 style={'width': '60vw', 'height': '60vw'})
                         ], className="chart-container"),
                         html.Div([
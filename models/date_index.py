@@ -0,0 +1,68 @@
+""" Script with the date index of the range slider. The entries are bucketed
+by day, and the slider selects contiguous ranges of days, weeks or months
+as slices of the sorted days """
+import numpy as np
+
+# labels of the buckets of each granularity
+LABEL_FORMATS = {'day': '%d-%m-%y', 'week': '%d-%m-%y', 'month': '%b %Y'}
+
+# maximum number of labelled marks on the range slider
+MAX_MARKS = 12
+
+
+def gen_date_index(df):
+    """ Buckets the entries by day. Returns the sorted days and the position
+    of each entry's day among them"""
+    dates = df['date']
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_localize(None)
+    days, positions = np.unique(
+        dates.to_numpy().astype('datetime64[D]'), return_inverse=True)
+    return {'days': days, 'positions': positions}
+
+
+def floor_days(days, granularity='day'):
+    """ Floors days to the start of their week (Monday) or month"""
+    if granularity == 'week':
+        # the 1st of January 1970 was a Thursday
+        return days - (days.astype(np.int64) + 3) % 7
+    if granularity == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    return days
+
+
+def gen_buckets(date_index, granularity='day'):
+    """ Groups the days of the index by day, week or month. Returns the start
+    of each bucket and the positions of the days where each bucket begins,
+    followed by the number of days"""
+    starts, first_days = np.unique(
+        floor_days(date_index['days'], granularity), return_index=True)
+    return {
+        'starts': starts,
+        'bounds': np.append(first_days, len(date_index['days'])),
+        'granularity': granularity}
+
+
+def day_range(buckets, start, end):
+    """ Returns the slice of day positions covered by the buckets from start
+    to end, both included"""
+    bounds = buckets['bounds']
+    end = min(end, len(bounds) - 2)
+    start = max(0, min(start, end))
+    return int(bounds[start]), int(bounds[end + 1])
+
+
+def bucket_labels(buckets):
+    """ Returns the labels of the buckets"""
+    label_format = LABEL_FORMATS[buckets['granularity']]
+    return [
+        start.item().strftime(label_format) if not np.isnat(start) else ''
+        for start in buckets['starts']]
+
+
+def gen_marks(buckets, max_marks=MAX_MARKS):
+    """ Returns the marks of the range slider, labelling evenly spaced
+    buckets so the labels never overlap"""
+    labels = bucket_labels(buckets)
+    step = -(-len(labels) // max_marks) or 1
+    return {i: labels[i] for i in range(0, len(labels), step)}
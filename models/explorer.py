@@ -1,17 +1,54 @@
 """ Script to launch the explorer search engine """
+import threading
+from collections import OrderedDict
 from dash import html, dcc
 import dash_bootstrap_components as dbc
+import numpy as np
+from models.tag_index import gen_tag_index, match_all, match_any, top_tags
 
+# number of entries in each page of the table
+PAGE_SIZE = 30
 
-def gen_df_sort_collections(df):
-    """ Make dataframe sorted by collections"""
-    df = df.sort_values(by='collections', ascending=False)
-    df['revenue'] = round(df['revenue'], 4)
-    return df
+# rows of the latest filters, by dataset, tags and search, so changing the
+# page does not filter the entries again
+ROWS_MEMO = OrderedDict()
+ROWS_MEMO_SIZE = 64
+rows_lock = threading.Lock()
+
+
+def gen_collections_order(df):
+    """ Returns the positions of the entries sorted by collections"""
+    return np.argsort(-df['collections'].to_numpy(), kind='stable')
+
+
+def n_pages(n_rows, page_size=PAGE_SIZE):
+    """ Returns the number of pages needed to list n_rows entries"""
+    return max(1, -(-n_rows // page_size))
+
+
+def page_rows(rows, page, page_size=PAGE_SIZE):
+    """ Returns the positions of the entries in a page, starting from 1"""
+    start = (page - 1) * page_size
+    return rows[start:start + page_size]
+
+
+def memo_rows(key, func):
+    """ Returns the rows memoized under the key, computing them with func the
+    first time. The least recently used rows are dropped from the memo."""
+    with rows_lock:
+        if key in ROWS_MEMO:
+            ROWS_MEMO.move_to_end(key)
+            return ROWS_MEMO[key]
+    rows = func()
+    with rows_lock:
+        ROWS_MEMO[key] = rows
+        while len(ROWS_MEMO) > ROWS_MEMO_SIZE:
+            ROWS_MEMO.popitem(last=False)
+    return rows
 
 
 def gen_table_explorer(df):
-    """ Generate table with the entries and hyperlinks"""
+    """ Generate table with the entries and hyperlinks of a page"""
 
     categories_dict = {
         i+1: {'title': title,
@@ -20,10 +57,10 @@ def gen_table_explorer(df):
               'author_link': author_link}
         for i, (title, link, author, author_link)
         in enumerate(zip(
-            df.head(30).title.values,
-            df.head(30).link.values,
-            df.head(30).author.values,
-            df.head(30).author_link.values))}
+            df.title.values,
+            df.link.values,
+            df.author.values,
+            df.author_link.values))}
 
     rows = []
     for k, v in categories_dict.items():
@@ -52,46 +89,95 @@ def gen_table_explorer(df):
     return table_body
 
 
-def gen_layout_explorer(df):
-    """ Generate Layout for the Explorer"""
+def gen_explorer_rows(df, tag_index, tags=None, mode='any',
+                      search_rows=None, order=None):
+    """ Returns the positions of the entries to list in the explorer. The
+    search results keep their ranking and are restricted to the selected
+    tags, otherwise the tagged entries (or all of them) are sorted by
+    collections. The order by collections of every entry can be given to
+    skip sorting them."""
+    if not tags:
+        if search_rows is not None:
+            return search_rows
+        return gen_collections_order(df) if order is None else order
 
-    df = gen_df_sort_collections(df)
+    if mode == 'all':
+        rows = match_all(tag_index, tags)
+    else:
+        rows = match_any(tag_index, tags)
+    if search_rows is not None:
+        return search_rows[np.isin(search_rows, rows)]
+    collections = df['collections'].to_numpy()[rows]
+    return rows[np.argsort(-collections, kind='stable')]
 
-    # Step 1: Extract all the tags from the 'Tags' column
-    all_tags = df['tags'].explode()
 
-    # Step 2: Count the occurrences of each tag
-    tag_counts = all_tags.value_counts()
+def gen_layout_explorer(df, derive=None):
+    """ Generate Layout for the Explorer. The derive function caches the
+    values computed from the dataset, such as the tag index"""
+    derive = derive or (lambda name, func: func(df))
 
-    # Step 3: Sort the tags based on their occurrences
-    sorted_tags = tag_counts.index.tolist()
+    tag_index = derive('tag_index', gen_tag_index)
+    order = derive('collections_order', gen_collections_order)
 
-    # Step 4: Select the top 30 tags
-    top_30_tags = sorted_tags[:50]
+    # the 50 tags with the most entries
+    top_50_tags = top_tags(tag_index, 50)
 
     layout = dcc.Loading([
                 html.Div([
                     html.Div([
+                        html.P(
+                            'Search the articles',
+                            className='tags-search-title'),
+                        dcc.Input(
+                            id='search-explorer',
+                            type='search',
+                            placeholder='Titles, descriptions and bodies',
+                            debounce=True,
+                            className='search-explorer'
+                        ),
                         html.P(
                             'Select one or more tags',
                             className='tags-search-title'),
                         dcc.Dropdown(
                             id='tags-dropdown-explorer',
                             multi=True,
-                            options=top_30_tags,
+                            options=top_50_tags,
                             className="dropdown-models"
                         ),
+                        dcc.RadioItems(
+                            id='tags-mode-explorer',
+                            options=[
+                                {'label': 'Any tag', 'value': 'any'},
+                                {'label': 'All tags', 'value': 'all'}],
+                            value='any',
+                            inline=True,
+                            className='tags-mode'
+                        ),
                     ], className="upload-container"),
+                    html.P(
+                        f"{len(df)} articles found",
+                        id='results-explorer',
+                        className='results-explorer'),
                     html.Div([
                         html.Div([
                             html.Table(
-                                gen_table_explorer(df),
+                                gen_table_explorer(
+                                    df.iloc[page_rows(order, 1)]),
                                 id='table-tags',
                                 style={
                                     'width': '80vw',
                                     'height': '70vw',
                                     'margin': 'auto'}),
-                        ])
+                        ]),
+                        dbc.Pagination(
+                            id='pagination-explorer',
+                            max_value=n_pages(len(df)),
+                            active_page=1,
+                            first_last=True,
+                            previous_next=True,
+                            fully_expanded=False,
+                            className='pagination-explorer'
+                        ),
                     ], className='collections-container'),
                 ], className='fade-in column')
             ], id="loading-sub-layout", type="circle")
@@ -0,0 +1,88 @@
+""" This script has the figure specs shared by the charts of the models. The
+figures are plain dictionaries built from a theme resolved once, so the
+callbacks skip the validation of the plotly graph objects """
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+
+# plotly.js does not know the named templates and colorscales of plotly.py,
+# so they are expanded here once instead of in every figure
+TEMPLATE = pio.templates['plotly_white'].to_plotly_json()
+DEFAULT_TEMPLATE = pio.templates[pio.templates.default].to_plotly_json()
+PEACH = go.bar.Marker(colorscale='peach').colorscale
+
+THEME = {
+    'paper_bgcolor': 'rgba(0,0,0,0)',
+    'plot_bgcolor': 'rgba(0,0,0,0)',
+    'font': {
+        'family': "Courier New, monospace",
+        'size': 18,
+        'color': 'white'}}
+
+MARGIN = {'l': 20, 'r': 20, 't': 20, 'b': 20}
+
+
+def gen_figure(data, layout):
+    """ Returns a figure with the theme of the dashboards. The template and
+    colorscales of the specs are shared, they must not be modified."""
+    return {'data': data, 'layout': {**THEME, **layout}}
+
+
+def chart_layout(xaxis, yaxis, yaxis_props=None, **props):
+    """ Returns the layout of a chart without legend, with the titles of its
+    axes"""
+    return {
+        'margin': MARGIN,
+        'bargroupgap': 0.1,
+        'showlegend': False,  # table being used for legend
+        'template': TEMPLATE,
+        'xaxis': {
+            'title': {'text': xaxis},
+            'autorange': True,
+            'showgrid': False},
+        'yaxis': {
+            'title': {'text': yaxis, 'standoff': 40},
+            'showgrid': False,
+            'side': 'left',
+            **(yaxis_props or {})},
+        **props}
+
+
+def bar_layout(xaxis, yaxis):
+    """ Returns the layout of a horizontal bar chart, the longest bar on
+    top"""
+    return chart_layout(
+        xaxis, yaxis, {'categoryorder': 'total ascending'}, bargap=0.1)
+
+
+def color_range(color):
+    """ Returns the minimum and maximum of the colour values, ignoring the
+    missing ones"""
+    color = np.asarray(color)
+    valid = color[~np.isnan(color.astype(float))]
+    if not len(valid):
+        return None, None
+    return valid.min(), valid.max()
+
+
+def colorbar_marker(color, title):
+    """ Returns the marker of bars coloured by a value, with its colour
+    bar"""
+    cmin, cmax = color_range(color)
+    return {
+        'color': np.asarray(color),
+        'colorscale': PEACH,
+        'cmin': cmin,
+        'cmax': cmax,
+        'colorbar': {'thickness': 15, 'title': {'text': title}}}
+
+
+def hbar(x, y, hovertemplate, **props):
+    """ Returns a horizontal bar trace"""
+    return {
+        'type': 'bar',
+        'orientation': 'h',
+        'x': np.asarray(x),
+        'y': np.asarray(y),
+        'hovertemplate': hovertemplate,
+        **props}
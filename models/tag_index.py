@@ -0,0 +1,61 @@
+""" Script with the inverted tag index of the explorer. For each tag it keeps
+the sorted positions of the entries having it, so tag filters are set
+operations on small integer arrays """
+from functools import reduce
+import numpy as np
+import pandas as pd
+
+
+def gen_tag_index(df):
+    """ Builds the inverted index of the tags. The rows of each tag are
+    stored contiguously and sorted, and the tags are sorted by number of
+    entries."""
+    lengths = df['tags'].map(len).to_numpy()
+    positions = np.repeat(np.arange(len(df), dtype=np.int32), lengths)
+    codes, tags = pd.factorize(
+        np.array([tag for tags in df['tags'] for tag in tags], dtype=object))
+
+    # one (tag, row) pair per entry, grouped by tag
+    pairs = np.unique(np.stack([codes, positions], axis=1), axis=0)
+    counts = np.bincount(pairs[:, 0], minlength=len(tags))
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    by_count = np.argsort(-counts, kind='stable')
+    return {
+        'tags': tags[by_count],
+        'counts': counts[by_count],
+        'starts': offsets[:-1][by_count],
+        'rows': pairs[:, 1].astype(np.int32),
+        'lookup': {tag: i for i, tag in enumerate(tags[by_count])}}
+
+
+def tag_rows(index, tag):
+    """ Returns the sorted positions of the entries having a tag"""
+    i = index['lookup'].get(tag)
+    if i is None:
+        return np.empty(0, dtype=np.int32)
+    start = index['starts'][i]
+    return index['rows'][start:start + index['counts'][i]]
+
+
+def match_any(index, tags):
+    """ Returns the sorted positions of the entries having any of the
+    tags"""
+    if not tags:
+        return np.empty(0, dtype=np.int32)
+    return np.unique(np.concatenate([tag_rows(index, tag) for tag in tags]))
+
+
+def match_all(index, tags):
+    """ Returns the sorted positions of the entries having all the tags"""
+    if not tags:
+        return np.empty(0, dtype=np.int32)
+    # starting with the rarest tag keeps the intersections small
+    rows = sorted((tag_rows(index, tag) for tag in tags), key=len)
+    return reduce(
+        lambda a, b: np.intersect1d(a, b, assume_unique=True), rows)
+
+
+def top_tags(index, n):
+    """ Returns the n tags with the most entries"""
+    return index['tags'][:n].tolist()
@@ -1,40 +1,147 @@
 """ This script has several functions to launch charts and wordlouds for
 the textual analysis """
 # pylint: disable=W0108
+import hashlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+import diskcache
 import langid
-from neattext.pipeline import TextPipeline
-from neattext.functions import remove_html_tags, remove_urls, remove_puncts
+from neattext.pattern_data import HTML_TAGS_REGEX, URL_PATTERN
+import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
 from dash import html, dcc
 from wordcloud import WordCloud
+from data_handler.cache_dir import CACHE_DIR
+from models.figures import gen_figure, chart_layout, bar_layout, hbar
+from models.token_index import gen_token_index, index_frequencies
 
+# texts classified by each process of the language detection pool
+CHUNK_SIZE = 500
 
-def clean_text(x):
-    """This function uses neattext functions to clean descriptions, bodys and
-    titles"""
-    clean_pipe = TextPipeline(
-        steps=[
-            remove_puncts,
-            remove_html_tags,
-            remove_urls])
+# below this number of texts the languages are detected in this process
+PARALLEL_THRESHOLD = 2000
 
-    return clean_pipe.fit(str(x))
+# texts cleaned by each process, and number of characters below which the
+# texts are cleaned in this process
+CLEAN_CHUNK_SIZE = 2000
+CLEAN_PARALLEL_THRESHOLD = 5000000
 
+# the punctuation removed by neattext's remove_puncts
+PUNCTS_TABLE = str.maketrans('', '', """!"&',-.;?_`""")
 
-def detect_language(x):
-    """ Function to detect the language"""
-    if x is None:
-        return None
+# texts shorter than this are not classified (0 classifies every text)
+MIN_TEXT_LENGTH = int(os.getenv('POST3_MIN_TEXT_LENGTH', '0'))
+
+# outliers drawn by each box of the text lengths chart
+MAX_OUTLIERS = 200
+
+# languages already detected, by hash of the normalised text. The memo is
+# kept on disk, shared by the workers and the background jobs building the
+# layouts, and its least recently stored entries are culled past its size
+MEMO_SIZE_MB = int(os.getenv('POST3_LANGUAGE_MEMO_MB', '64'))
+LANGUAGE_MEMO = diskcache.Cache(
+    os.path.join(CACHE_DIR, 'languages'),
+    size_limit=MEMO_SIZE_MB * 1024 ** 2, cull_limit=0)
+
+
+def run_in_chunks(func, values, chunk_size, processes=None):
+    """ Applies func to chunks of the values across a process pool and
+    returns the list of results of each chunk"""
+    chunks = [
+        values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(func, chunks))
+
+
+def may_have_urls(text):
+    """ Checks if a text contains the start of a url"""
+    return '://' in text or 'www' in text.lower()
+
+
+def clean_chunk(texts):
+    """ Removes the punctuation, html tags and urls of a series of texts,
+    in the same order as neattext's remove_puncts, remove_html_tags and
+    remove_urls. The regexes only run on the texts that can match them."""
+    texts = texts.str.translate(PUNCTS_TABLE)
+    mask = texts.str.contains('<', regex=False)
+    texts[mask] = texts[mask].str.replace(HTML_TAGS_REGEX, '', regex=True)
+    mask = texts.map(may_have_urls)
+    texts[mask] = texts[mask].str.replace(URL_PATTERN, '', regex=True)
+    return texts
+
+
+def clean_texts(texts, processes=None):
+    """This function cleans descriptions, bodys and titles. Large series are
+    cleaned in chunks across a process pool."""
+    texts = texts.astype(str)
+    if processes == 1 or texts.str.len().sum() < CLEAN_PARALLEL_THRESHOLD:
+        return clean_chunk(texts)
+    return pd.concat(
+        run_in_chunks(clean_chunk, texts, CLEAN_CHUNK_SIZE, processes))
+
+
+def normalise_text(x):
+    """ Collapses the whitespace of a text, so duplicates share one entry in
+    the language memo"""
+    return " ".join(str(x).split())
+
+
+def text_hash(text):
+    """ Returns the digest of a text used as key of the language memo"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+def classify_texts(texts):
+    """ Detects the language of a list of texts"""
+    return [langid.classify(text)[0] for text in texts]
+
+
+def detect_languages(texts, processes=None, min_length=MIN_TEXT_LENGTH):
+    """ Detects the languages of a series of texts. Each distinct text is
+    classified once, results are memoized and large batches are spread in
+    chunks across a process pool. The memo is keyed by the normalised text,
+    but the texts are classified as they are."""
+    normalised = texts.map(normalise_text, na_action='ignore')
+    keys = normalised.map(text_hash, na_action='ignore')
+
+    languages = {}
+    pending = {}
+    for key, text, normalised_text in zip(keys, texts, normalised):
+        if not isinstance(key, bytes) or key in languages or key in pending:
+            continue
+        language = LANGUAGE_MEMO.get(key)
+        if language is not None:
+            languages[key] = language
+        elif len(normalised_text) < min_length:
+            languages[key] = None
+        else:
+            pending[key] = str(text)
+
+    to_classify = list(pending.values())
+    if len(to_classify) < PARALLEL_THRESHOLD or processes == 1:
+        detected = classify_texts(to_classify)
     else:
-        res = langid.classify(x)
-        return res[0]
+        # load the model before forking, so the workers share it
+        langid.classify('')
+        detected = [
+            lang for chunk in run_in_chunks(
+                classify_texts, to_classify, CHUNK_SIZE, processes)
+            for lang in chunk]
+    languages.update(zip(pending, detected))
+
+    with LANGUAGE_MEMO.transact():
+        for key, language in zip(pending, detected):
+            LANGUAGE_MEMO.set(key, language)
+    LANGUAGE_MEMO.cull()
+
+    return keys.map(languages.get, na_action='ignore')
 
 
-def create_lang_bar_chart(df):
+def create_lang_bar_chart(languages):
     """creates a bar chart showing the languages used in
-    the articles' dataset"""
-    languages = {
+    the articles' dataset, from their language codes"""
+    language_names = {
         'en': 'English',
         'zh': 'Chinese',
         'es': 'Spanish',
@@ -110,8 +217,7 @@ def create_lang_bar_chart(df):
         'haw': 'Hawaiian',
     }
 
-    df['lang'] = df['lang'].map(languages)
-    df = pd.DataFrame(df['lang'].value_counts())
+    df = pd.DataFrame(languages.map(language_names).value_counts())
     df = df.head(10)
 
     colors_traces = [
@@ -126,135 +232,141 @@ def create_lang_bar_chart(df):
         '#ffeecd',
         '#fff6e6']
 
-    data = go.Bar(
-            x=df['count'],
-            y=df.index,
-            marker_color=colors_traces,
-            orientation='h',
-            hovertemplate="""<br>Language: %{y}
+    data = hbar(
+        df['count'], df.index,
+        """<br>Language: %{y}
             <br>Number of Articles: %{x}
-            <extra></extra>""")
-
-    layout = go.Layout(
-                margin=dict(l=20, r=20, t=20, b=20),
-                bargap=0.1,
-                bargroupgap=0.1,
-                showlegend=False,  # table being used for legend
-                template='plotly_white',
-                yaxis=dict(
-                    title='Languages',
-                    title_standoff=40,
-                    showgrid=False,
-                    side='left'),
-                xaxis=dict(
-                    title='Counts',
-                    autorange=True,
-                    showgrid=False))
-
-    fig = go.Figure({'data': data, 'layout': layout})
-    fig.update_layout(
-        yaxis={'categoryorder': 'total ascending'},
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        font=dict(
-            family="Courier New, monospace",
-            size=18,
-            color="white")
-        )
-    return fig
-
-
-def create_box_chart(df):
+            <extra></extra>""",
+        marker={'color': colors_traces})
+
+    return gen_figure([data], bar_layout('Counts', 'Languages'))
+
+
+def box_stats(values, max_outliers=MAX_OUTLIERS):
+    """ Computes the statistics of a box plot as Plotly does with the linear
+    quartile method: the fences are the furthest values within 1.5 IQR of
+    the quartiles. At most max_outliers outliers are kept, evenly sampled
+    from the sorted outliers so the extremes are always drawn."""
+    values = np.sort(np.asarray(values, dtype=float))
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return None
+
+    # plotly interpolates the quartiles at p * n - 0.5 (hazen)
+    q1, median, q3 = np.percentile(values, [25, 50, 75], method='hazen')
+    iqr = q3 - q1
+    lowerfence = min(
+        q1, values[np.searchsorted(values, q1 - 1.5 * iqr, side='left')])
+    upperfence = max(
+        q3, values[np.searchsorted(values, q3 + 1.5 * iqr, side='right') - 1])
+
+    outliers = values[(values < lowerfence) | (values > upperfence)]
+    if len(outliers) > max_outliers:
+        sample = np.linspace(0, len(outliers) - 1, max_outliers)
+        outliers = outliers[sample.round().astype(int)]
+
+    return {
+        'q1': q1,
+        'median': median,
+        'q3': q3,
+        'lowerfence': lowerfence,
+        'upperfence': upperfence,
+        'outliers': outliers}
+
+
+def gen_length_stats(df, descriptions):
+    """ Returns the box plot statistics of the lengths of the bodies,
+    descriptions and titles"""
+    return {
+        'Bodies': box_stats(df['body'].astype(str).str.len()),
+        'Descriptions': box_stats(descriptions.str.len()),
+        'Titles': box_stats(df['title'].str.len())}
+
+
+def create_box_chart(stats):
     """ Create a boxplot chart with the lengths of characters for body,
-    title and descriptions"""
-
-    df['body'] = df['body'].astype(str)
-    df['len_body'] = df['body'].apply(lambda x: len(x))
-    df['len_title'] = df['title'].apply(lambda x: len(x))
-    df['len_description'] = df['description'].apply(lambda x: len(x))
-    data_1 = go.Box(
-            y=df['len_body'],
-            quartilemethod="linear",
-            name="Bodies",
-            marker_color='#ffac05'
-            )
-
-    data_2 = go.Box(
-            y=df['len_description'],
-            quartilemethod="linear",
-            name="Descriptions",
-            marker_color='#ffc450'
-            )
-
-    data_3 = go.Box(
-            y=df['len_title'],
-            quartilemethod="linear",
-            name="Titles",
-            marker_color='#ffdd9b'
-            )
-
-    layout = go.Layout(
-                margin=dict(l=20, r=20, t=20, b=20),
-                bargroupgap=0.1,
-                showlegend=False,  # table being used for legend
-                template='plotly_white',
-                yaxis=dict(
-                    title='Text Length',
-                    title_standoff=40,
-                    showgrid=False,
-                    type='log',
-                    side='left'),
-                xaxis=dict(
-                    title='Text Types',
-                    autorange=True,
-                    showgrid=False))
-
-    fig = go.Figure({'data': [data_1, data_2, data_3], 'layout': layout})
-    fig.update_layout(
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        font=dict(
-            family="Courier New, monospace",
-            size=18,
-            color="white")
-        )
-    return fig
-
-
-def create_wordcloud_titles(df):
-    """ Creates a wordcloud for the titles """
-    word_cloud = WordCloud(
-        collocations=False,
-        background_color='rgba(255, 255, 255, 0)',
-        colormap='Blues',
-        mode="RGBA", width=300, height=280).generate(
-            " ".join(list(df.title.values)))
+    title and descriptions, from their precomputed statistics"""
+    colors = {
+        'Bodies': '#ffac05',
+        'Descriptions': '#ffc450',
+        'Titles': '#ffdd9b'}
+
+    data = []
+    for name, box in stats.items():
+        if box is None:
+            continue
+        data.append({
+            'type': 'box',
+            'x': [name],
+            'q1': [box['q1']],
+            'median': [box['median']],
+            'q3': [box['q3']],
+            'lowerfence': [box['lowerfence']],
+            'upperfence': [box['upperfence']],
+            'name': name,
+            'marker': {'color': colors[name]}})
+        data.append({
+            'type': 'scatter',
+            'x': [name] * len(box['outliers']),
+            'y': box['outliers'],
+            'mode': 'markers',
+            'name': name,
+            'marker': {'color': colors[name]},
+            'hovertemplate': "%{y}<extra></extra>"})
+
+    layout = chart_layout('Text Types', 'Text Length', {'type': 'log'})
+    return gen_figure(data, layout)
 
-    return word_cloud.to_image()
 
+def title_token_index(df):
+    """ Returns the token index of the titles"""
+    return gen_token_index(df['title'].astype(str))
 
-def create_wordcloud_description(df):
-    """ Creates a wordcloud for the descriptions """
-    # Replace 'nan' strings with actual NaN values
-    df['description'].replace('nan', pd.NA, inplace=True)
 
-    # Drop rows with NaN values in the 'description' column
-    df.dropna(subset=['description'], inplace=True)
+def gen_wordcloud_frequencies(name, derive):
+    """ Returns the word frequencies of the 'titles' or 'descriptions' word
+    cloud, summed from the token index of the column. The derive function
+    caches the indexes with the cleaned descriptions."""
+    if name == 'titles':
+        index = derive('token_index_titles', title_token_index)
+        return index_frequencies(index)
+
+    descriptions = derive('clean_description', clean_descriptions)
+    index = derive(
+        'token_index_descriptions', lambda df: gen_token_index(descriptions))
+    return index_frequencies(index, mask=descriptions.to_numpy() != 'nan')
+
+
+def render_wordcloud(frequencies):
+    """ Renders a wordcloud from word frequencies, as PNG bytes"""
     word_cloud = WordCloud(
         collocations=False,
         background_color='rgba(255, 255, 255, 0)',
         colormap='Blues',
-        mode="RGBA", width=300, height=280).generate(
-            " ".join(list(df.description.values)))
+        mode="RGBA", width=300, height=280).generate_from_frequencies(
+            frequencies)
+
+    image = io.BytesIO()
+    word_cloud.to_image().save(image, format='PNG')
+    return image.getvalue()
+
 
-    return word_cloud.to_image()
+def clean_descriptions(df):
+    """ Returns the cleaned descriptions of a dataset"""
+    return clean_texts(df['description'])
 
 
-def gen_layout_textual(df):
-    """Generate Layout For the Textual Analysis"""
+def gen_layout_textual(df, derive=None):
+    """Generate Layout For the Textual Analysis. The derive function caches
+    the values computed from the dataset, such as the cleaned descriptions.
+    The dataset itself is never modified."""
+    derive = derive or (lambda name, func: func(df))
 
-    df['description'] = df['description'].apply(clean_text)
-    df['lang'] = df['description'].apply(detect_language)
+    descriptions = derive('clean_description', clean_descriptions)
+    languages = derive(
+        'languages', lambda df: detect_languages(descriptions))
+    length_stats = derive(
+        'length_stats', lambda df: gen_length_stats(df, descriptions))
 
     layout = dcc.Loading([
                 html.Div([
@@ -266,7 +378,7 @@ def gen_layout_textual(df):
                                 ),
                             dcc.Graph(
                                 id="graph-networks-languages",
-                                figure=create_lang_bar_chart(df),
+                                figure=create_lang_bar_chart(languages),
                                 style={
                                     'width': '80vw',
                                     'height': '70vw',
@@ -281,7 +393,7 @@ def gen_layout_textual(df):
                                 ),
                             dcc.Graph(
                                 id="graph-networks-lengths",
-                                figure=create_box_chart(df),
+                                figure=create_box_chart(length_stats),
                                 style={
                                     'width': '80vw',
                                     'height': '70vw',
@@ -294,9 +406,11 @@ def gen_layout_textual(df):
                                 'Titles Wordcloud',
                                 className="chart-title"
                                 ),
+                            # the image is rendered in the background and
+                            # its src is set once the layout is displayed
                             html.Img(
-                                id="wordcloud",
-                                src=create_wordcloud_titles(df)),
+                                id="wordcloud-titles",
+                                className="wordcloud"),
                         ], className="chart-container"),
                     ], className='collections-container'),
                     html.Div([
@@ -306,8 +420,8 @@ def gen_layout_textual(df):
                                 className="chart-title"
                                 ),
                             html.Img(
-                                id="wordcloud",
-                                src=create_wordcloud_description(df)),
+                                id="wordcloud-descriptions",
+                                className="wordcloud"),
                         ], className="chart-container"),
                     ], className='collections-container'),
                 ], className='fade-in column')
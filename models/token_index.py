@@ -0,0 +1,86 @@
+""" Script with the token frequency index of the textual analysis. It keeps
+the sparse token counts of each document, so the word frequencies of any
+subset of the dataset can be summed without tokenising the texts again """
+import re
+from collections import defaultdict
+import numpy as np
+from wordcloud import STOPWORDS
+
+# same tokens and stopwords as WordCloud.process_text
+TOKEN_REGEX = re.compile(r"\w[\w']*")
+STOPWORDS_LOWER = {word.lower() for word in STOPWORDS}
+
+
+def tokenize(text):
+    """ Splits a text into words, removing the possessive 's, numbers and
+    stopwords"""
+    words = [
+        word[:-2] if word.lower().endswith("'s") else word
+        for word in TOKEN_REGEX.findall(text)]
+    return [
+        word for word in words
+        if not word.isdigit() and word.lower() not in STOPWORDS_LOWER]
+
+
+def gen_token_index(texts):
+    """ Builds the index of a series of texts: the vocabulary and the token
+    counts of each document, in compressed sparse row layout"""
+    vocabulary = {}
+    indptr = [0]
+    indices = []
+    counts = []
+    for text in texts:
+        doc_counts = defaultdict(int)
+        for word in tokenize(text):
+            doc_counts[vocabulary.setdefault(word, len(vocabulary))] += 1
+        indices.extend(doc_counts.keys())
+        counts.extend(doc_counts.values())
+        indptr.append(len(indices))
+
+    return {
+        'tokens': np.array(list(vocabulary), dtype=object),
+        'indptr': np.array(indptr, dtype=np.int64),
+        'indices': np.array(indices, dtype=np.int32),
+        'counts': np.array(counts, dtype=np.int32)}
+
+
+def sum_token_counts(index, mask=None):
+    """ Sums the counts of each token over the documents selected by a
+    boolean mask, or over every document"""
+    indices = index['indices']
+    counts = index['counts']
+    if mask is not None:
+        selected = np.repeat(np.asarray(mask), np.diff(index['indptr']))
+        indices = indices[selected]
+        counts = counts[selected]
+    return np.bincount(
+        indices, weights=counts, minlength=len(index['tokens'])).astype(int)
+
+
+def fuse_counts(tokens, counts):
+    """ Merges the counts of the cases and plurals of each word, keeping its
+    most common case, as wordcloud's process_tokens does"""
+    cases = defaultdict(dict)
+    for word, count in zip(tokens, counts):
+        cases[word.lower()][word] = count
+
+    # merge plurals into the singular count (simple cases only)
+    for key in list(cases):
+        if key.endswith('s') and not key.endswith('ss') and key[:-1] in cases:
+            singular_cases = cases[key[:-1]]
+            for word, count in cases.pop(key).items():
+                singular_cases[word[:-1]] = (
+                    singular_cases.get(word[:-1], 0) + count)
+
+    return {
+        max(word_cases.items(), key=lambda item: item[1])[0]:
+            sum(word_cases.values())
+        for word_cases in cases.values()}
+
+
+def index_frequencies(index, mask=None):
+    """ Returns the word frequencies of the documents selected by a boolean
+    mask, or of every document"""
+    totals = sum_token_counts(index, mask)
+    present = np.flatnonzero(totals)
+    return fuse_counts(index['tokens'][present], totals[present])